@@ -0,0 +1,164 @@
+import multiprocessing
+import threading
+from multiprocessing import shared_memory
+
+from powersupplyexp import Experiment, PowerSupply
+from samplebuffer import DEFAULT_CAPACITY, SampleBuffer, bufferSize
+
+SHUTDOWN_TIMEOUT = 5  # Seconds the acquisition process gets to finish its files before it is terminated
+
+# Events the acquisition process sends back, as tuples starting with their name:
+# ("connected", idn), ("disconnected",), ("started", runTime), ("completed", finished), ("error", title, message),
+# ("paused",), ("resumed",), ("finished",) and ("metrics", {"instrument": snapshot, "experiment": snapshot})
+
+
+class _AcquisitionServer:
+    # Runs in the child process: owns the power supply and the experiments, and writes samples into shared memory
+    def __init__(self, connection, memory: shared_memory.SharedMemory, capacity: int):
+        self._connection = connection
+        self._sendLock = threading.Lock()  # Events come from the experiment thread and the polling event loop
+        self._memory = memory
+        self._capacity = capacity
+        self._powerSupply = None
+        self._experiment = None
+
+    def _send(self, *event):
+        with self._sendLock:
+            try:
+                self._connection.send(event)
+            except OSError:  # The window has closed
+                pass
+
+    def connect(self, resourceName: str, currentLimit: float, **powerSupplyOptions):
+        if self._powerSupply is not None:
+            self._powerSupply.kill()
+        powerSupply = PowerSupply(resourceName, **powerSupplyOptions)
+
+        def onConnect():
+            self._send("connected", powerSupply.getIDN())
+            powerSupply.applyCurrentLimit(currentLimit)
+            powerSupply.setCurrent(currentLimit)
+
+        powerSupply.onConnect(onConnect)
+        powerSupply.onDisconnect(lambda: self._send("disconnected"))
+        powerSupply.onError(lambda title, message: self._send("error", title, message))
+        self._powerSupply = powerSupply.tryConnect()
+
+    def startExperiment(self, **settings):
+        if self._experiment is not None and self._experiment.is_alive():
+            self._send("error", "Experiment running", "An experiment is already running in the acquisition process.")
+            self._send("finished")
+            return
+        if self._experiment is not None and self._experiment.samples is not None:
+            self._experiment.samples.close()
+        experiment = Experiment(powerSupply=self._powerSupply, sampleMemory=self._memory.buf,
+            sampleCapacity=self._capacity, onStart=lambda: self._send("started", experiment.runTime),
+            onComplete=lambda finished: self._send("completed", finished),
+            onError=lambda title, message: self._send("error", title, message),
+            onFinish=lambda: self._send("finished"), onPause=lambda: self._send("paused"),
+            onResume=lambda: self._send("resumed"), **settings)
+        self._experiment = experiment
+        experiment.start()
+
+    def killExperiment(self):
+        if self._experiment is not None:
+            self._experiment.kill()
+
+    def requestMetrics(self):
+        snapshot = {}
+        if self._powerSupply is not None:
+            snapshot["instrument"] = self._powerSupply.getMetrics().snapshot()
+        if self._experiment is not None:
+            snapshot["experiment"] = self._experiment.metrics.snapshot()
+        self._send("metrics", snapshot)
+
+    def shutdown(self):
+        if self._experiment is not None:
+            self._experiment.kill()
+            self._experiment.join()
+            if self._experiment.samples is not None:
+                self._experiment.samples.close()
+        if self._powerSupply is not None:
+            self._powerSupply.kill()
+
+    def serve(self):
+        commands = {
+            "connect": self.connect,
+            "startExperiment": self.startExperiment,
+            "killExperiment": self.killExperiment,
+            "requestMetrics": self.requestMetrics
+        }
+        while True:
+            try:
+                command, args, kwargs = self._connection.recv()
+            except EOFError:  # The window is gone without saying so
+                break
+            if command=="shutdown":
+                break
+            commands[command](*args, **kwargs)
+        self.shutdown()
+
+
+def _serve(connection, memoryName: str, capacity: int):
+    memory = shared_memory.SharedMemory(name=memoryName)
+    try:
+        _AcquisitionServer(connection, memory, capacity).serve()
+    finally:
+        memory.close()
+
+
+class AcquisitionProcess:
+    # Runs the power supply and experiments in a child process, so that the window's load cannot disturb their timing.
+    # Samples arrive through a shared memory SampleBuffer and everything else through a pipe.
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self._memory = shared_memory.SharedMemory(create=True, size=bufferSize(capacity))
+        self._samples = SampleBuffer.attach(self._memory.buf, capacity)
+        self._connection, childConnection = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve, args=(childConnection, self._memory.name, capacity),
+            daemon=True)
+        self._process.start()
+        childConnection.close()
+
+    def _send(self, command: str, *args, **kwargs):
+        self._connection.send((command, args, kwargs))
+
+    def connect(self, resourceName: str, currentLimit: float, **powerSupplyOptions):
+        self._send("connect", resourceName, currentLimit, **powerSupplyOptions)
+
+    def startExperiment(self, **settings):
+        # Settings are Experiment's plain keyword arguments; its callbacks are replaced by events
+        self._send("startExperiment", **settings)
+
+    def killExperiment(self):
+        self._send("killExperiment")
+
+    def requestMetrics(self):
+        self._send("requestMetrics")
+
+    def events(self) -> list:
+        # Every event that has arrived, without waiting for more
+        events = []
+        try:
+            while self._connection.poll():
+                events.append(self._connection.recv())
+        except EOFError:
+            pass
+        return events
+
+    def getSamples(self) -> SampleBuffer:
+        return self._samples
+
+    def isAlive(self) -> bool:
+        return self._process.is_alive()
+
+    def shutdown(self):
+        try:
+            self._send("shutdown")
+        except OSError:
+            pass
+        self._process.join(SHUTDOWN_TIMEOUT)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._samples.close()
+        self._memory.close()
+        self._memory.unlink()
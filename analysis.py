@@ -0,0 +1,223 @@
+"""
+Summarizes recorded experiment data: tracking error, settling time per step, energy and peak current.
+
+    python analysis.py experiment-2024-6-20_14-5-3.npz [more data files] [--current-limit 30]
+
+Each summary is printed and written next to its data file as <data file>-summary.json. Experiments run the
+analysis on their own data when they finish.
+"""
+import argparse
+import json
+import os
+import sys
+from itertools import islice
+
+from datawriter import METADATA_MEMBER
+from samplebuffer import COLUMNS
+
+CHUNK_ROWS = 1 << 20  # Rows analysed at once, which bounds memory use for any file size
+SETTLE_FRACTION = 0.02  # A step has settled once the output stays within this fraction of the step size
+SETTLE_FLOOR = 0.01  # Volts; the tolerance never gets tighter than this, so small steps can settle despite noise
+LIMIT_MARGIN = 0.01  # Fraction below the current limit at which the supply is counted as current limited
+
+_TIME, _TARGET, _ACTUAL, _CURRENT, _POWER = range(len(COLUMNS))
+
+
+def _readCSVChunks(path: str):
+    import numpy
+    with open(path, "r") as file:
+        file.readline()  # Header
+        while True:
+            lines = list(islice(file, CHUNK_ROWS))
+            if len(lines)==0:
+                return
+            yield numpy.loadtxt(lines, delimiter=",", ndmin=2)
+
+
+def _readNPZChunks(path: str):
+    import numpy
+    with numpy.load(path) as archive:
+        chunks = sorted(key.split("/")[1] for key in archive.files if key.startswith(COLUMNS[0] + "/"))
+        for chunk in chunks:
+            yield numpy.column_stack([archive[f"{column}/{chunk}"] for column in COLUMNS])
+
+
+def readMetadata(path: str) -> dict:
+    if path.endswith(".npz"):
+        import numpy
+        with numpy.load(path) as archive:
+            return json.loads(archive[METADATA_MEMBER]) if METADATA_MEMBER in archive.files else {}
+    try:
+        with open(os.path.splitext(path)[0] + "-metadata.json", "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+class RunAnalysis:
+    # Accumulates statistics over consecutive chunks of rows, carrying the state a chunk boundary would cut
+    def __init__(self, settleFraction: float = SETTLE_FRACTION, settleFloor: float = SETTLE_FLOOR):
+        import numpy
+        self._numpy = numpy
+        self._settleFraction = settleFraction
+        self._settleFloor = settleFloor
+        self._rows = 0
+        self._squaredErrorTime = 0.0  # Integral of the squared tracking error over time
+        self._trackedTime = 0.0
+        self._maxError = 0.0
+        self._energy = 0.0
+        self._peakCurrent = 0.0
+        self._peakCurrentTime = None
+        self._last = None  # Last row of the previous chunk
+        self._lastIsChange = True  # Whether that row changed the target
+        self._lastOutside = False  # Whether that row was outside its step's tolerance
+        self._stepSize = 0.0
+        # Per step arrays, one per chunk: start time, time of the last sample outside the tolerance (NaN if none) and
+        # time of the sample after it (NaN if the step ended first); a chunk's first rows can extend the last step of
+        # the chunk before
+        self._stepStarts = []
+        self._lastOutsideTimes = []
+        self._settledTimes = []
+
+    def add(self, rows):
+        numpy = self._numpy
+        if len(rows)==0:
+            return
+        times, targets, actuals = rows[:, _TIME], rows[:, _TARGET], rows[:, _ACTUAL]
+        errors = actuals - targets
+        self._rows += len(rows)
+
+        # Trapezoidal integral of power, joined to the previous chunk
+        previous = rows[:1] if self._last is None else self._last[None, :]
+        joined = numpy.concatenate((previous, rows))
+        intervals = numpy.diff(joined[:, _TIME])
+        self._energy += float(numpy.sum((joined[1:, _POWER] + joined[:-1, _POWER]) / 2 * intervals))
+
+        peak = int(numpy.argmax(rows[:, _CURRENT]))
+        if rows[peak, _CURRENT] > self._peakCurrent or self._peakCurrentTime is None:
+            self._peakCurrent = float(rows[peak, _CURRENT])
+            self._peakCurrentTime = float(times[peak])
+
+        # A step starts wherever the target changes; local step 0 continues the last step of the previous chunk
+        previousTargets = numpy.concatenate(([0.0 if self._last is None else self._last[_TARGET]], targets[:-1]))
+        changes = targets!=previousTargets
+        changes[0] |= self._last is None
+
+        # Every row's error holds until the next row, so rows count by time rather than by number, as adaptive polling
+        # packs them into the transients. Rows that change the target are left out: their measurement is from before
+        # the new setpoint was written.
+        lastError = 0.0 if self._last is None else self._last[_ACTUAL] - self._last[_TARGET]
+        heldErrors = numpy.concatenate(([lastError], errors[:-1]))
+        weights = numpy.where(numpy.concatenate(([self._lastIsChange], changes[:-1])), 0.0, intervals)
+        self._squaredErrorTime += float(numpy.dot(heldErrors * heldErrors, weights))
+        self._trackedTime += float(weights.sum())
+        if not changes.all():
+            self._maxError = max(self._maxError, float(numpy.abs(errors[~changes]).max()))
+
+        localSteps = numpy.cumsum(changes)
+        stepCount = int(localSteps[-1]) + 1
+        sizes = numpy.concatenate(([self._stepSize], (targets - previousTargets)[changes]))
+        tolerances = numpy.maximum(self._settleFraction * numpy.abs(sizes), self._settleFloor)
+        self._stepSize = float(sizes[-1])
+
+        # A step settles at the first sample after its last one outside the tolerance, if the step lasts that long
+        lastOutside = numpy.full(stepCount, numpy.nan)
+        settled = numpy.full(stepCount, numpy.nan)
+        isOutside = numpy.abs(errors) > tolerances[localSteps]
+        outside = numpy.flatnonzero(isOutside)
+        if len(outside) > 0:
+            outsideSteps = localSteps[outside]
+            lastOfStep = outside[numpy.append(outsideSteps[1:]!=outsideSteps[:-1], True)]  # One row per step
+            lastOutside[localSteps[lastOfStep]] = times[lastOfStep]
+            following = lastOfStep + 1
+            inStep = following < len(rows)
+            inStep[inStep] = localSteps[following[inStep]]==localSteps[lastOfStep[inStep]]
+            settled[localSteps[lastOfStep[inStep]]] = times[following[inStep]]
+
+        if len(self._stepStarts) > 0:
+            if not numpy.isnan(lastOutside[0]):
+                self._lastOutsideTimes[-1][-1] = lastOutside[0]
+                self._settledTimes[-1][-1] = settled[0]
+            elif self._lastOutside and not changes[0]:
+                self._settledTimes[-1][-1] = times[0]  # The previous chunk ended outside, and this row is back inside
+        if stepCount > 1:
+            self._stepStarts.append(times[changes])
+            self._lastOutsideTimes.append(lastOutside[1:])
+            self._settledTimes.append(settled[1:])
+        self._last = rows[-1].copy()
+        self._lastIsChange = bool(changes[-1])
+        self._lastOutside = bool(isOutside[-1])
+
+    def summary(self, currentLimit: float = None) -> dict:
+        numpy = self._numpy
+        starts = numpy.concatenate(self._stepStarts) if len(self._stepStarts) > 0 else numpy.empty(0)
+        lastOutside = numpy.concatenate(self._lastOutsideTimes) if len(self._lastOutsideTimes) > 0 else numpy.empty(0)
+        settledTimes = numpy.concatenate(self._settledTimes) if len(self._settledTimes) > 0 else numpy.empty(0)
+        # A step whose last sample is still outside the tolerance never settled
+        neverOutside = numpy.isnan(lastOutside)
+        settled = neverOutside | ~numpy.isnan(settledTimes)
+        settlingTimes = numpy.where(neverOutside, 0.0, settledTimes - starts)[settled]
+        summary = {
+            "rows": self._rows,
+            "duration": float(self._last[_TIME]) if self._last is not None else 0.0,
+            "trackingErrorRMS": (self._squaredErrorTime / self._trackedTime) ** 0.5 if self._trackedTime > 0 else 0.0,
+            "trackingErrorMax": self._maxError,
+            "energy": self._energy,
+            "peakCurrent": self._peakCurrent,
+            "peakCurrentTime": self._peakCurrentTime,
+            "steps": len(starts),
+            "unsettledSteps": int(len(starts) - numpy.count_nonzero(settled)),
+            "settlingTimeMean": float(settlingTimes.mean()) if len(settlingTimes) > 0 else None,
+            "settlingTimeP95": float(numpy.percentile(settlingTimes, 95)) if len(settlingTimes) > 0 else None,
+            "settlingTimeMax": float(settlingTimes.max()) if len(settlingTimes) > 0 else None,
+            "settleFraction": self._settleFraction,
+            "settleFloor": self._settleFloor
+        }
+        if currentLimit is not None:
+            summary["currentLimit"] = currentLimit
+            summary["peakCurrentFraction"] = self._peakCurrent / currentLimit if currentLimit > 0 else None
+            summary["currentLimited"] = self._peakCurrent >= currentLimit * (1 - LIMIT_MARGIN)
+        return summary
+
+
+def analyzeFile(path: str, currentLimit: float = None, settleFraction: float = SETTLE_FRACTION,
+        settleFloor: float = SETTLE_FLOOR) -> dict:
+    # Streams the data file through RunAnalysis and writes <data file>-summary.json; returns the summary
+    metadata = readMetadata(path)
+    if currentLimit is None:
+        currentLimit = metadata.get("currentLimit")
+    analysis = RunAnalysis(settleFraction, settleFloor)
+    for rows in _readNPZChunks(path) if path.endswith(".npz") else _readCSVChunks(path):
+        analysis.add(rows)
+    summary = {"dataFile": os.path.basename(path), **analysis.summary(currentLimit)}
+    with open(os.path.splitext(path)[0] + "-summary.json", "w") as file:
+        json.dump(summary, file, indent=4)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize recorded experiment data")
+    parser.add_argument("paths", nargs="+", help="Data files (.csv or .npz) written by an experiment")
+    parser.add_argument("--current-limit", type=float, help="Current limit in amps, overriding the file's metadata")
+    parser.add_argument("--settle-fraction", type=float, default=SETTLE_FRACTION,
+        help="Fraction of the step size the output must stay within to count as settled")
+    parser.add_argument("--settle-floor", type=float, default=SETTLE_FLOOR, help="Smallest settling tolerance in volts")
+    args = parser.parse_args()
+
+    failed = False
+    for path in args.paths:
+        try:
+            summary = analyzeFile(path, args.current_limit, args.settle_fraction, args.settle_floor)
+        except (OSError, ValueError) as error:
+            print(f"{path}: {error}", file=sys.stderr)
+            failed = True
+            continue
+        print(path)
+        for name, value in summary.items():
+            print(f"{name:>22}: {value:.6g}" if isinstance(value, float) else f"{name:>22}: {value}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__=="__main__":
+    main()
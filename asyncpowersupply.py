@@ -0,0 +1,500 @@
+import asyncio
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+from instrumentio import CONTROL_PRIORITY, InstrumentWorker, SETPOINT_PRIORITY, TELEMETRY_PRIORITY
+from metrics import Metrics
+from simulatedsupply import SimulatedResourceManager, isSimulated
+from visaresources import getResourceManager
+
+DEFAULT_POLL_PERIOD = 0.1  # Seconds between measurements
+POLL_RATE_SMOOTHING = 0.1  # Weight given to the newest poll interval in the achieved polling rate
+DEFAULT_FAST_POLL_WINDOW = 0.5  # Seconds of fast polling after each setpoint change, while the output moves
+DEFAULT_FAST_POLL_PERIOD = 0.0  # Seconds between measurements in that window; 0 polls as fast as the instrument answers
+MEASURE_ALL_QUERY = "MEASure:VOLTage?;:MEASure:CURRent?;:MEASure:POWer?\n"  # Voltage, current and power in one round trip
+RECONNECT_DELAY = 0.1  # Seconds before the first reconnection attempt, doubled after every failed one
+MAX_RECONNECT_DELAY = 10.0
+RECONNECT_JITTER = 0.25  # Fraction the delays vary by at random, so supplies that dropped together do not retry together
+OPEN_TIMEOUT = 1000  # Milliseconds a connection attempt may wait for the instrument
+PROBE_TIMEOUT = 500  # Milliseconds the liveness probe waits for its answer, instead of the full VISA timeout
+
+# Timestamps are time.monotonic() values taken when the instrument was read or written
+Measurement = namedtuple("Measurement", ["sequence", "timestamp", "voltage", "current", "power"])
+Setpoint = namedtuple("Setpoint", ["sequence", "timestamp", "voltage"])
+
+_eventLoop = None
+_eventLoopLock = threading.Lock()
+
+
+def getEventLoop() -> asyncio.AbstractEventLoop:
+    # One background event loop drives the polling of every supply that is used through the threaded API
+    global _eventLoop
+    with _eventLoopLock:
+        if _eventLoop is None:
+            _eventLoop = asyncio.new_event_loop()
+            threading.Thread(target=_eventLoop.run_forever, daemon=True).start()
+        return _eventLoop
+
+
+def _commandName(command: str) -> str:
+    # The SCPI header without its arguments, so that every VOLT write lands in the same histogram
+    return command.strip().split(" ")[0]
+
+
+def adaptivePollPeriod(sinceSetpoint: float, pollPeriod: float, fastPollWindow: float, fastPollPeriod: float) -> float:
+    # Fast for fastPollWindow after a setpoint change, then backing off linearly to pollPeriod over another window
+    if fastPollWindow <= 0 or fastPollPeriod >= pollPeriod:
+        return pollPeriod
+    if sinceSetpoint < fastPollWindow:
+        return fastPollPeriod
+    backoff = min((sinceSetpoint - fastPollWindow) / fastPollWindow, 1.0)
+    return fastPollPeriod + backoff * (pollPeriod - fastPollPeriod)
+
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class AsyncPowerSupply:
+    # Blocking VISA calls run as jobs on an InstrumentWorker, which is this class's executor
+    def __init__(self, resourceName: str, onConnect=lambda: None, onDisconnect=lambda: None,
+            pollPeriod: float = DEFAULT_POLL_PERIOD, batchedMeasurement: bool = True, resourceManager=None,
+            fastPollWindow: float = DEFAULT_FAST_POLL_WINDOW, fastPollPeriod: float = DEFAULT_FAST_POLL_PERIOD,
+            onError=lambda title, message: None):
+        self._instr = None  # Only touched by jobs running on self._io
+        self._io = InstrumentWorker()
+        self._resourceName = resourceName
+        if resourceManager is not None:
+            self._rm = resourceManager
+        elif isSimulated(resourceName):
+            self._rm = SimulatedResourceManager()
+        else:
+            self._rm = None  # The shared VISA manager, fetched by the first connection attempt on the I/O worker
+        self._onConnect = onConnect
+        self._onDisconnect = onDisconnect
+        self._onError = onError
+        self._lastConnected = False
+        self._active = False
+        self._currentLimit = None
+        self._IDN = None
+        self._targetVoltage = 0
+        self._targetCurrent = 0
+        self._outputHeld = False  # Set while an experiment runs; only then does a reconnect put its voltage back
+        self._inputStopped = False  # A reconnect outside an experiment stopped the input
+        self._measurement = Measurement(0, time.monotonic(), 0, 0, 0)
+        self._setpoint = Setpoint(0, time.monotonic(), 0)
+        self._updated = threading.Condition()
+        self._waiters = []  # (loop, future) pairs of coroutines waiting in nextUpdate()
+        self._pollPeriod = pollPeriod  # Slowest polling, reached once the output has been steady for a while
+        self._fastPollWindow = fastPollWindow
+        self._fastPollPeriod = fastPollPeriod
+        self._pollWake = None  # asyncio.Event that cuts the poll loop's sleep short when a setpoint is written
+        self._pollTask = None  # The running _pollLoop(), as an asyncio.Task or a concurrent.futures.Future
+        self._loop = None
+        self._batchedMeasurement = batchedMeasurement
+        self._metrics = Metrics()  # Recorded from the I/O worker, except for disconnects, which the poll loop counts
+        self._lastPoll = None
+        self._pollInterval = None
+        self._failedAttempts = 0  # Connection attempts that failed since the last success
+        self._nextAttempt = 0.0  # time.monotonic() before which no connection is attempted
+        self._hasConnected = False  # After the first connection, reconnecting restores the output instead of zeroing it
+
+    def onConnect(self, onConnect):
+        self._onConnect = onConnect
+
+    def onDisconnect(self, onDisconnect):
+        self._onDisconnect = onDisconnect
+
+    def onError(self, onError):
+        # onError(title, message) is called if polling stops on an error it cannot recover from
+        self._onError = onError
+
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        # Starts polling on the given loop, or on the running loop when called from a coroutine
+        if self._active:
+            return
+        self._active = True
+        self._lastPoll = None
+        self._failedAttempts = 0
+        self._nextAttempt = 0.0
+        if self._io.ident is not None:  # A worker stopped by stop() cannot be restarted
+            self._io = InstrumentWorker()
+        self._io.start()
+        if loop is None:
+            self._pollTask = asyncio.get_running_loop().create_task(self._pollLoop())
+        else:
+            self._pollTask = asyncio.run_coroutine_threadsafe(self._pollLoop(), loop)
+        self._pollTask.add_done_callback(self._onPollLoopDone)
+
+    def _onPollLoopDone(self, pollTask):
+        # _pollLoop() only ends on its own after stop(); anything else would leave the readouts frozen without a word
+        if pollTask.cancelled() or pollTask.exception() is None:
+            return
+        error = pollTask.exception()
+        if pollTask is self._pollTask:
+            self._io.stop()
+            self._active = False  # So that start() can poll again
+        self._metrics.count("pollLoopFailures")
+        self._onError("Polling stopped", f"Polling {self._resourceName} stopped: {type(error).__name__}: {error}")
+
+    def stop(self):
+        self._outputHeld = False
+        if self._active:
+            self._submit(lambda: self._write("INP:STOP\n"))  # Disable DC input
+            self._io.stop()
+        self._active = False
+
+    def _submit(self, job, priority: int = CONTROL_PRIORITY, coalesceKey: str = None) -> Future:
+        return self._io.submit(job, priority, coalesceKey)
+
+    async def _call(self, job, priority: int = CONTROL_PRIORITY, coalesceKey: str = None):
+        return await asyncio.wrap_future(self._submit(job, priority, coalesceKey))
+
+    def _checkForDisconnect(self):
+        import pyvisa
+        try:
+            self._instr.session
+        except pyvisa.errors.InvalidSession:
+            self._dropConnection()
+        except AttributeError:  # If the _instr field is already None
+            pass
+
+    def _timed(self, name: str, call):
+        before = time.perf_counter()
+        try:
+            return call()
+        finally:
+            self._metrics.histogram(name).record(time.perf_counter() - before)
+
+    def _connect(self):
+        import pyvisa  # Loaded here, on the I/O worker, so that it never delays the window
+        if time.monotonic() < self._nextAttempt:
+            return
+        self._metrics.count("connectAttempts")
+        try:
+            if self._rm is None:
+                self._rm = getResourceManager()
+            self._instr = self._timed("connect",
+                lambda: self._rm.open_resource(self._resourceName, open_timeout=OPEN_TIMEOUT))
+            self._IDN = self._probe()
+            if self._hasConnected:
+                self._restore()
+            else:
+                self._instr.write("CURR 0\n")  # Set the current to zero before enabling DC input
+                self._instr.write("INP:START\n")  # Enable DC input
+        # ValueError and OSError: no VISA library was found; InvalidSession: the session was closed while connecting
+        except (pyvisa.errors.VisaIOError, pyvisa.errors.InvalidSession, ValueError, OSError):
+            self._metrics.count("connectFailures")
+            self._closeInstrument()
+            self._backOff()
+            return
+        self._failedAttempts = 0
+        self._hasConnected = True
+        self._metrics.count("connects")
+        self._onConnect()
+
+    def _restore(self):
+        # Puts back the current limit and current from before the connection dropped. The voltage is only put back while
+        # an experiment holds the output; otherwise the output is left at 0 V with the input stopped, so that a setpoint
+        # from a run that has ended is never replayed.
+        if self._currentLimit is not None:
+            self._instr.write(f"SOUR:CURR {self._currentLimit}\n")
+        self._instr.write(f"CURR {self._targetCurrent}\n")
+        if self._outputHeld:
+            self._instr.write(f"VOLT {self._targetVoltage}\n")
+            self._instr.write("INP:START\n")
+            self._inputStopped = False
+        else:
+            self._targetVoltage = 0
+            self._instr.write("VOLT 0\n")
+            self._instr.write("INP:STOP\n")
+            self._inputStopped = True
+        self._metrics.count("reconnects")
+
+    def _backOff(self):
+        delay = min(RECONNECT_DELAY * 2 ** min(self._failedAttempts, 16), MAX_RECONNECT_DELAY)
+        self._failedAttempts += 1
+        self._nextAttempt = time.monotonic() + delay * random.uniform(1 - RECONNECT_JITTER, 1 + RECONNECT_JITTER)
+
+    def _probe(self) -> str:
+        # *IDN? with a short timeout, so that a dead link is noticed without waiting out the full VISA timeout
+        timeout = self._instr.timeout
+        self._instr.timeout = PROBE_TIMEOUT
+        try:
+            return self._timed("*IDN?", lambda: self._instr.query("*IDN?"))
+        finally:
+            self._instr.timeout = timeout
+
+    def _isAlive(self) -> bool:
+        import pyvisa
+        try:
+            self._probe()
+            return True
+        except (pyvisa.errors.VisaIOError, pyvisa.errors.InvalidSession):
+            return False
+
+    def _closeInstrument(self):
+        import pyvisa
+        instr, self._instr = self._instr, None
+        if instr is not None:
+            try:
+                instr.close()
+            except (pyvisa.errors.Error, OSError):
+                pass
+
+    def _onIOError(self):
+        # An operation failed; the session is only dropped if the instrument does not answer the probe either
+        self._metrics.count("ioErrors")
+        if self.isConnected() and not self._isAlive():
+            self._dropConnection()
+
+    def _dropConnection(self):
+        # Polling goes on and reconnects after the back-off, as after any other disconnect
+        self._closeInstrument()
+        self._failedAttempts = 0
+        self._backOff()
+
+    def _write(self, command: str):
+        if self.isConnected():
+            self._timed(_commandName(command), lambda: self._instr.write(command))
+
+    def _query(self, query: str):
+        if self.isConnected():
+            return self._timed(_commandName(query), lambda: self._instr.query(query))
+
+    def _notify(self):
+        # Must be called while holding self._updated
+        self._updated.notify_all()
+        for loop, waiter in self._waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+        self._waiters.clear()
+
+    def _publishMeasurement(self, timestamp: float, voltage: float, current: float, power: float):
+        with self._updated:
+            self._measurement = Measurement(self._measurement.sequence + 1, timestamp, voltage, current, power)
+            self._notify()
+
+    def _publishSetpoint(self, timestamp: float, voltage: float):
+        with self._updated:
+            self._setpoint = Setpoint(self._setpoint.sequence + 1, timestamp, voltage)
+            self._notify()
+        pollWake = self._pollWake
+        if pollWake is not None and self._fastPollWindow > 0:
+            self._loop.call_soon_threadsafe(pollWake.set)  # Start the fast polling now, not after the current sleep
+
+    def _refreshSeparately(self):
+        before = time.monotonic()
+        voltage = float(self._query("MEASure:VOLTage?\n"))
+        current = float(self._query("MEASure:CURRent?\n"))
+        self._publishMeasurement((before + time.monotonic()) / 2, voltage, current, voltage * current)
+
+    def _refreshBatched(self):
+        import pyvisa
+        before = time.monotonic()
+        try:
+            values = [float(value) for value in self._query(MEASURE_ALL_QUERY).replace(";", ",").split(",")]
+            if len(values)!=3:
+                raise ValueError
+        except (ValueError, pyvisa.errors.VisaIOError) as error:
+            if isinstance(error, pyvisa.errors.VisaIOError):
+                self._onIOError()
+                if not self.isConnected():
+                    return  # The link is down, which says nothing about the compound query
+            self._batchedMeasurement = False  # The instrument rejected the compound query, so stop sending it
+            self._write("*CLS\n")  # Clear the error the rejected query left behind
+            self._refreshSeparately()
+            return
+        self._publishMeasurement((before + time.monotonic()) / 2, *values)
+
+    def _refresh(self):
+        try:
+            if self._batchedMeasurement:
+                self._refreshBatched()
+            else:
+                self._refreshSeparately()
+        except ValueError:
+            pass
+
+    def _poll(self):
+        import pyvisa
+        now = time.monotonic()
+        if self._lastPoll is not None:
+            interval = now - self._lastPoll
+            self._metrics.histogram("pollInterval").record(interval)
+            self._pollInterval = interval if self._pollInterval is None else \
+                self._pollInterval + POLL_RATE_SMOOTHING * (interval - self._pollInterval)
+            self._metrics.setValue("pollingRate", 1 / self._pollInterval if self._pollInterval > 0 else 0.0)
+        self._lastPoll = now
+        self._checkForDisconnect()
+        if self.isConnected():
+            try:
+                self._refresh()
+            except pyvisa.errors.InvalidSession:  # The session was closed under the poll, so the link is gone
+                self._metrics.count("invalidSessions")
+                self._dropConnection()
+            except pyvisa.errors.VisaIOError:
+                self._onIOError()
+                raise
+        else:
+            self._connect()
+
+    def _currentPollPeriod(self, now: float) -> float:
+        return adaptivePollPeriod(now - self._setpoint.timestamp, self._pollPeriod, self._fastPollWindow,
+            self._fastPollPeriod)
+
+    async def _pollLoop(self):
+        import pyvisa
+        loop = asyncio.get_running_loop()
+        self._loop = loop
+        self._pollWake = asyncio.Event()
+        while self._active:
+            pollStart = loop.time()
+            self._pollWake.clear()
+            try:
+                await self._call(self._poll, TELEMETRY_PRIORITY)
+            except asyncio.CancelledError:  # The I/O worker was stopped
+                break
+            except pyvisa.errors.VisaIOError:
+                self._metrics.count("pollErrors")
+            if self._lastConnected and not self.isConnected():
+                self._metrics.count("disconnects")
+                self._onDisconnect()
+            self._lastConnected = self.isConnected()
+            delay = pollStart + self._currentPollPeriod(time.monotonic()) - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._pollWake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        self._pollWake = None
+
+    def getIDN(self):
+        return self._IDN
+
+    def getMetrics(self) -> Metrics:
+        return self._metrics
+
+    def getPollingRate(self) -> float:
+        # Polls per second actually achieved, smoothed over the last several polls
+        return self._metrics.getValue("pollingRate", 0.0)
+
+    def setPollPeriod(self, pollPeriod: float):
+        self._pollPeriod = pollPeriod
+
+    def getPollPeriod(self):
+        return self._pollPeriod
+
+    def setAdaptivePolling(self, fastPollWindow: float, fastPollPeriod: float = DEFAULT_FAST_POLL_PERIOD):
+        # A window of 0 turns adaptive polling off, so every poll is pollPeriod apart
+        self._fastPollWindow = fastPollWindow
+        self._fastPollPeriod = fastPollPeriod
+
+    async def applyCurrentLimit(self, limit):
+        self._currentLimit = limit  # Recorded even while disconnected, so that a reconnect applies the newest limit
+        await self._call(lambda: self._write(f"SOUR:CURR {limit}\n"))
+
+    def _writeVoltage(self, voltage: float) -> bool:
+        import pyvisa
+        if not self.isConnected():
+            return False
+        try:
+            self._timed("VOLT", lambda: self._instr.write(f"VOLT {voltage}\n"))
+        except (pyvisa.errors.VisaIOError, pyvisa.errors.InvalidSession):
+            self._onIOError()
+            return False
+        self._publishSetpoint(time.monotonic(), voltage)
+        return True
+
+    async def setVoltage(self, voltage: float) -> bool:
+        # Returns whether the voltage reached the instrument, which it does not while the connection is down
+        self._targetVoltage = voltage
+        return await self._call(lambda: self._writeVoltage(voltage), SETPOINT_PRIORITY, coalesceKey="VOLT")
+
+    async def setCurrent(self, current: float):
+        self._targetCurrent = current
+        await self._call(lambda: self._write(f"CURR {current}\n"), SETPOINT_PRIORITY, coalesceKey="CURR")
+
+    def _startInput(self):
+        if self._inputStopped and self.isConnected():
+            self._write("INP:START\n")
+            self._inputStopped = False
+
+    async def setOutputHeld(self, held: bool):
+        # An experiment holds the output while it runs, so that a reconnect restores its voltage; see _restore()
+        self._outputHeld = held
+        if held:
+            await self._call(self._startInput, SETPOINT_PRIORITY)  # Queued ahead of the run's first setpoint
+
+    async def measure(self) -> Measurement:
+        # Takes a fresh measurement instead of waiting for the next poll
+        await self._call(lambda: self._refresh() if self.isConnected() else None, TELEMETRY_PRIORITY)
+        return self._measurement
+
+    async def writeCommand(self, command: str):
+        await self._call(lambda: self._write(command))
+
+    async def query(self, query: str):
+        return await self._call(lambda: self._query(query))
+
+    def getMeasurement(self) -> Measurement:
+        return self._measurement
+
+    def getSetpoint(self) -> Setpoint:
+        return self._setpoint
+
+    def publishTargetVoltage(self, voltage: float):
+        # For voltages the instrument applied on its own, such as steps of a list it is running
+        self._targetVoltage = voltage
+        self._publishSetpoint(time.monotonic(), voltage)
+
+    def _hasUpdate(self, measurementSequence: int, setpointSequence: int) -> bool:
+        return self._measurement.sequence!=measurementSequence or self._setpoint.sequence!=setpointSequence
+
+    def waitForUpdate(self, measurementSequence: int, setpointSequence: int, timeout: float = None) -> (Measurement, Setpoint):
+        # Blocks until there is a measurement or setpoint newer than the given sequence numbers, or until the timeout
+        with self._updated:
+            self._updated.wait_for(lambda: self._hasUpdate(measurementSequence, setpointSequence), timeout)
+            return self._measurement, self._setpoint
+
+    async def nextUpdate(self, measurementSequence: int, setpointSequence: int, timeout: float = None) -> (Measurement, Setpoint):
+        # Coroutine version of waitForUpdate()
+        with self._updated:
+            if not self._hasUpdate(measurementSequence, setpointSequence):
+                waiter = asyncio.get_running_loop().create_future()
+                self._waiters.append((asyncio.get_running_loop(), waiter))
+            else:
+                waiter = None
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._measurement, self._setpoint
+
+    def getCurrentLimit(self):
+        return self._currentLimit
+
+    def getVoltage(self):
+        return self._measurement.voltage
+
+    def getCurrent(self):
+        return self._measurement.current
+
+    def getTargetVoltage(self):
+        return self._targetVoltage
+
+    def getTargetCurrent(self):
+        return self._targetCurrent
+
+    def getPower(self):
+        if self.isConnected():
+            return self._measurement.power
+        else:
+            return 0
+
+    def isConnected(self):
+        return self._instr is not None
@@ -0,0 +1,247 @@
+"""
+Runs a queue of experiments from a manifest file without the window.
+
+    python batch.py manifest.json
+    python batch.py manifest.json --dry-run
+
+A dry run drives a simulated supply on a virtual clock instead of the instrument, so hours of profile take seconds.
+It writes the same data files, metrics and summaries as a real run, marked "dryRun" in their metadata.
+
+The manifest is JSON; relative paths in it are relative to the manifest file:
+
+    {
+        "resource": "TCPIP0::169.254.197.112::inst0::INSTR",
+        "currentLimit": 30,
+        "maxVoltage": 60,
+        "pollPeriod": 0.1,
+        "fastPollWindow": 0.5,
+        "dataFolder": "data",
+        "defaults": {"runTime": 10, "endAtZero": false, "dataFormat": "npz"},
+        "experiments": [
+            {"name": "ramp", "setpoints": "ramp.csv"},
+            {"name": "sine", "waveform": {"samplePeriod": 0.01, "segments": [...]}, "endAtZero": true}
+        ]
+    }
+
+Several instruments are named in "resources" instead of "resource", and each experiment picks one with "channel"
+(the first one by default). Consecutive experiments with the same "group" start together, one per channel:
+
+    {
+        "resources": {"left": "TCPIP0::169.254.197.112::inst0::INSTR", "right": "TCPIP0::169.254.197.113::inst0::INSTR"},
+        "experiments": [
+            {"name": "left ramp", "channel": "left", "setpoints": "ramp.csv", "group": "ramps"},
+            {"name": "right ramp", "channel": "right", "setpoints": "ramp.csv", "group": "ramps"},
+            {"name": "sine", "channel": "right", "waveform": {...}}
+        ]
+    }
+
+With more than one instrument, the channel is part of every data file name.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import timedelta
+
+from asyncpowersupply import DEFAULT_FAST_POLL_PERIOD, DEFAULT_FAST_POLL_WINDOW
+from clock import REAL_CLOCK, Clock, VirtualClock
+from datawriter import DEFAULT_FLUSH_INTERVAL, FORMATS
+from dryrun import DryRunSupply
+from instrumentmanager import DEFAULT_LEAD_TIME, InstrumentManager
+from powersupplyexp import Experiment, PowerSupply
+from setpointsource import SetpointFileError
+from waveform import fromDescription
+
+CONNECT_TIMEOUT = 10
+DEFAULT_CURRENT_LIMIT = 30
+DEFAULT_CHANNEL = "main"  # Name of the instrument a manifest gives as "resource"
+DRY_RUN_SEED = 0  # Seeds the simulated latency jitter so that repeated dry runs give identical files
+
+# Experiment settings a manifest entry or its defaults may give, with their values when neither does
+EXPERIMENT_DEFAULTS = {
+    "runTime": 10,
+    "endAtZero": True,
+    "interpolate": False,
+    "listMode": False,
+    "listLength": 512,
+    "dataFormat": "csv",
+    "flushInterval": DEFAULT_FLUSH_INTERVAL
+}
+
+
+def loadManifest(path: str) -> dict:
+    with open(path, "r") as file:
+        manifest = json.load(file)
+    if len(manifest.get("experiments", []))==0:
+        raise ValueError(f"{path} does not list any experiments")
+    return manifest
+
+
+def getResources(manifest: dict, resourceName: str = None) -> dict:
+    # Instrument names mapped to their VISA resource names; resourceName replaces a lone "resource"
+    if "resources" in manifest:
+        if resourceName is not None or "resource" in manifest:
+            raise ValueError("Give either one \"resource\" or named \"resources\", not both")
+        if len(manifest["resources"])==0:
+            raise ValueError("\"resources\" does not name any instruments")
+        return dict(manifest["resources"])
+    return {DEFAULT_CHANNEL: resourceName if resourceName is not None else manifest.get("resource")}
+
+
+def connect(manager: InstrumentManager, name: str, resourceName: str, currentLimit: float, pollPeriod: float,
+        fastPollWindow: float = DEFAULT_FAST_POLL_WINDOW, fastPollPeriod: float = DEFAULT_FAST_POLL_PERIOD) -> PowerSupply:
+    powerSupply = manager.connect(name, resourceName, pollPeriod=pollPeriod, fastPollWindow=fastPollWindow,
+        fastPollPeriod=fastPollPeriod, onError=lambda title, message: print(f"{title}: {message}", file=sys.stderr))
+    deadline = time.monotonic() + CONNECT_TIMEOUT
+    while not powerSupply.isConnected():
+        if time.monotonic() > deadline:
+            manager.disconnect(name)
+            raise RuntimeError(f"Could not connect to {resourceName}")
+        time.sleep(0.05)
+    powerSupply.applyCurrentLimit(currentLimit).result()
+    powerSupply.setCurrent(currentLimit).result()
+    return powerSupply
+
+
+def connectDryRun(currentLimit: float, pollPeriod: float, speed: float = None,
+        fastPollWindow: float = DEFAULT_FAST_POLL_WINDOW, fastPollPeriod: float = DEFAULT_FAST_POLL_PERIOD) -> DryRunSupply:
+    powerSupply = DryRunSupply(VirtualClock(speed=speed), pollPeriod, fastPollWindow, fastPollPeriod, seed=DRY_RUN_SEED)
+    powerSupply.applyCurrentLimit(currentLimit)
+    powerSupply.setCurrent(currentLimit)
+    return powerSupply
+
+
+def makeExperiment(entry: dict, number: int, manifest: dict, baseFolder: str, powerSupply: PowerSupply,
+        clock: Clock = REAL_CLOCK) -> Experiment:
+    settings = {**EXPERIMENT_DEFAULTS, **manifest.get("defaults", {}), **entry}
+    name = settings.get("name", str(number))
+    experiment = {key: settings[key] for key in EXPERIMENT_DEFAULTS}
+    if "waveform" in settings:
+        experiment["setpoints"] = fromDescription(settings["waveform"])
+    elif "setpoints" in settings:
+        experiment["setpointPath"] = os.path.join(baseFolder, settings["setpoints"])
+    else:
+        raise ValueError(f"Experiment {name} has neither \"setpoints\" nor \"waveform\"")
+    if settings["dataFormat"] not in FORMATS:
+        raise ValueError(f"Experiment {name} has the unknown data format \"{settings['dataFormat']}\"")
+    dataFolder = os.path.join(baseFolder, settings.get("dataFolder", manifest.get("dataFolder", ".")))
+    os.makedirs(dataFolder, exist_ok=True)
+    return Experiment(powerSupply=powerSupply, dataFolder=dataFolder, name=name, clock=clock,
+        maxVoltage=manifest.get("maxVoltage"), onError=lambda title, message: print(f"{name}: {title}: {message}", file=sys.stderr), **experiment)
+
+
+def _groups(experiments: list):
+    # Lists of (number, entry) pairs to start together: runs of consecutive entries with the same "group"
+    group = []
+    for number, entry in enumerate(experiments, 1):
+        if len(group) > 0 and (entry.get("group") is None or entry.get("group")!=group[-1][1].get("group")):
+            yield group
+            group = []
+        group.append((number, entry))
+    if len(group) > 0:
+        yield group
+
+
+def _printSummary(experiment: Experiment, label: str, started: float):
+    summary = experiment.scheduler.timingSummary()
+    print(f"    {label}{'finished' if experiment.finished else 'stopped early'}: {summary['steps']} steps, "
+        f"mean timing error {summary['meanError'] * 1000:.2f} ms, max {summary['maxError'] * 1000:.2f} ms")
+    if experiment.getClock().isVirtual():
+        print(f"    dry run: the profile takes {timedelta(seconds=round(experiment.scheduler.getRunTime()))}, "
+            f"simulated in {time.monotonic() - started:.2f} s")
+        metrics = experiment.metrics
+        print(f"    out of range: {metrics.getCount('clampedSetpoints')} negative setpoints clamped to 0 V, "
+            f"{metrics.getCount('overRangeSetpoints')} above the supply's maximum voltage clamped to it, "
+            f"{metrics.getCount('currentLimitedSamples')} samples held at the current limit")
+
+
+def runBatch(manifest: dict, baseFolder: str, manager: InstrumentManager) -> int:
+    # Runs every experiment in order, each group of them at once; returns how many did not finish their profile
+    failures = 0
+    experiments = manifest["experiments"]
+    channels = manager.getNames()
+    for group in _groups(experiments):
+        started = {}
+        labels = {}
+        for number, entry in group:
+            channel = entry.get("channel", channels[0])
+            try:
+                if channel not in channels:
+                    raise ValueError(f"Experiment {entry.get('name', number)} uses the unknown channel \"{channel}\"")
+                if channel in started:
+                    raise ValueError(f"Experiment {entry.get('name', number)} shares the channel \"{channel}\" with "
+                        f"another experiment in its group")
+                powerSupply = manager.getPowerSupply(channel)
+                started[channel] = makeExperiment(entry, number, manifest, baseFolder, powerSupply,
+                    powerSupply.getClock())
+            except (SetpointFileError, ValueError, OSError) as error:
+                print(f"Skipping experiment {number}: {error}", file=sys.stderr)
+                failures += 1
+                continue
+            labels[channel] = f"{entry.get('name', number)}: " if len(group) > 1 else ""
+            print(f"[{number}/{len(experiments)}] {entry.get('name', number)}"
+                + (f" on {channel}" if len(channels) > 1 else ""))
+        if len(started)==0:
+            continue
+        startTime = time.monotonic()
+        # Started as soon as the previous group is finalized, so there is no gap between them
+        manager.startExperiments(started, leadTime=DEFAULT_LEAD_TIME if len(started) > 1 else 0)
+        try:
+            while any(experiment.is_alive() for experiment in started.values()):
+                manager.waitForExperiments(0.2)  # Short joins keep Ctrl+C responsive
+        except KeyboardInterrupt:
+            manager.killExperiments()
+            manager.waitForExperiments()  # Let them close their data files
+            raise
+        for channel, experiment in started.items():
+            if not experiment.finished:
+                failures += 1
+            if experiment.scheduler is not None:
+                _printSummary(experiment, labels[channel], startTime)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the experiments in a manifest one after another")
+    parser.add_argument("manifest", help="JSON file listing the experiments")
+    parser.add_argument("--resource", help="VISA resource name, overriding the manifest's")
+    parser.add_argument("--poll-period", type=float, help="Seconds between measurements, overriding the manifest's")
+    parser.add_argument("--dry-run", action="store_true", help="Run against a simulated supply on a virtual clock")
+    parser.add_argument("--speed", type=float,
+        help="Pace a dry run at this many times real time instead of running it as fast as possible")
+    args = parser.parse_args()
+
+    manifest = loadManifest(args.manifest)
+    try:
+        resources = getResources(manifest, args.resource)
+    except ValueError as error:
+        parser.error(str(error))
+    if None in resources.values() and not args.dry_run:
+        parser.error("No resource given in the manifest or with --resource")
+    pollPeriod = args.poll_period if args.poll_period is not None else manifest.get("pollPeriod", 0.1)
+    currentLimit = manifest.get("currentLimit", DEFAULT_CURRENT_LIMIT)
+    fastPollWindow = manifest.get("fastPollWindow", DEFAULT_FAST_POLL_WINDOW)
+    fastPollPeriod = manifest.get("fastPollPeriod", DEFAULT_FAST_POLL_PERIOD)
+    manager = InstrumentManager()
+    try:
+        for name, resourceName in resources.items():
+            if args.dry_run:  # Every simulated supply has a virtual clock of its own
+                powerSupply = manager.add(name,
+                    connectDryRun(currentLimit, pollPeriod, args.speed, fastPollWindow, fastPollPeriod))
+            else:
+                powerSupply = connect(manager, name, resourceName, currentLimit, pollPeriod, fastPollWindow,
+                    fastPollPeriod)
+            print(f"Connected to {powerSupply.getIDN().strip()}" + (f" as {name}" if len(resources) > 1 else ""))
+        failures = runBatch(manifest, os.path.dirname(os.path.abspath(args.manifest)), manager)
+    except KeyboardInterrupt:
+        print("Batch aborted", file=sys.stderr)
+        failures = 1
+    finally:
+        manager.shutdown()
+    if failures > 0:
+        sys.exit(1)
+
+
+if __name__=="__main__":
+    main()
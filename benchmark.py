@@ -0,0 +1,170 @@
+"""
+Timing benchmarks run against the simulated power supply.
+
+    python benchmark.py --output results.json
+    python benchmark.py --baseline results.json
+
+With --baseline, the run fails if any metric is more than --tolerance worse than the saved results.
+With --virtual, the step timing run uses a virtual clock and seeded jitter, so its results are the same on every run
+and every machine and only change when the scheduler does.
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+from clock import REAL_CLOCK, VirtualClock
+from dryrun import DryRunSupply
+from powersupplyexp import PowerSupply
+from samplebuffer import COLUMNS, SampleBuffer
+from scheduler import SetpointScheduler
+from setpointsource import fromRows
+from simulatedsupply import SIMULATED_PREFIX, SimulatedResourceManager
+
+CONNECT_TIMEOUT = 5
+SETTLE_TOLERANCE = 0.01  # Fraction of the step a measurement must be within to count as settled
+HIGHER_IS_BETTER = {"pollingRate"}
+VIRTUAL_SEED = 0
+CURRENT_LIMIT = 1000  # Amps; high enough to keep the simulated load out of constant current mode
+
+
+def percentile(values: list, fraction: float) -> float:
+    if len(values)==0:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def connectSimulatedSupply(instrumentOptions: dict, pollPeriod: float) -> PowerSupply:
+    powerSupply = PowerSupply(SIMULATED_PREFIX + "INSTR", autoConnect=True, pollPeriod=pollPeriod,
+        resourceManager=SimulatedResourceManager(**instrumentOptions))
+    deadline = time.monotonic() + CONNECT_TIMEOUT
+    while not powerSupply.isConnected():
+        if time.monotonic() > deadline:
+            raise RuntimeError("The simulated power supply did not connect")
+        time.sleep(0.01)
+    powerSupply.applyCurrentLimit(CURRENT_LIMIT).result()
+    powerSupply.setCurrent(CURRENT_LIMIT).result()
+    return powerSupply
+
+
+def benchmarkStepTiming(instrumentOptions: dict, points: int, stepTime: float, virtual: bool = False) -> dict:
+    if virtual:
+        powerSupply = DryRunSupply(VirtualClock(), 0.1, seed=VIRTUAL_SEED, **instrumentOptions)
+        powerSupply.applyCurrentLimit(CURRENT_LIMIT)
+        powerSupply.setCurrent(CURRENT_LIMIT)
+        clock = powerSupply.getClock()
+    else:
+        powerSupply = connectSimulatedSupply(instrumentOptions, 0.1)
+        clock = REAL_CLOCK
+    scheduler = SetpointScheduler(fromRows([[i % 10] for i in range(points)]), points * stepTime,
+        lambda voltage: powerSupply.setVoltage(voltage).result(), clock=clock)
+    start = clock.monotonic()
+    scheduler.run(start)
+    overrun = clock.monotonic() - start - scheduler.getRunTime()
+    powerSupply.kill()
+    errors = [abs(step.error) for step in scheduler.timing]
+    return {
+        "stepErrorMean": sum(errors) / len(errors),
+        "stepErrorP95": percentile(errors, 0.95),
+        "stepErrorMax": max(errors),
+        "runOverrun": max(overrun, 0.0)
+    }
+
+
+def benchmarkPolling(instrumentOptions: dict, duration: float) -> dict:
+    powerSupply = connectSimulatedSupply(instrumentOptions, 0)
+    first = powerSupply.getMeasurement()
+    time.sleep(duration)
+    last = powerSupply.getMeasurement()
+    powerSupply.kill()
+    return {"pollingRate": (last.sequence - first.sequence) / (last.timestamp - first.timestamp)}
+
+
+def benchmarkSetpointLatency(instrumentOptions: dict, trials: int) -> dict:
+    powerSupply = connectSimulatedSupply(instrumentOptions, 0)
+    latencies = []
+    for trial in range(trials):
+        voltage = 1.0 + trial % 2
+        measurement = powerSupply.getMeasurement()
+        setpoint = powerSupply.getSetpoint()
+        start = time.monotonic()
+        powerSupply.setVoltage(voltage)
+        while abs(measurement.voltage - voltage) > SETTLE_TOLERANCE or measurement.timestamp < start:
+            measurement, setpoint = powerSupply.waitForUpdate(measurement.sequence, setpoint.sequence, 1)
+        latencies.append(measurement.timestamp - start)
+    powerSupply.kill()
+    return {
+        "setpointLatencyMean": sum(latencies) / len(latencies),
+        "setpointLatencyP95": percentile(latencies, 0.95)
+    }
+
+
+def benchmarkMemory(samples: int) -> dict:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    buffer = SampleBuffer(capacity=samples)
+    for i in range(samples):
+        buffer.append(*([float(i)] * len(COLUMNS)))
+    bufferBytes = tracemalloc.get_traced_memory()[0] - before
+    before = tracemalloc.get_traced_memory()[0]
+    rows = [[float(i)] * len(COLUMNS) for i in range(samples)]
+    listBytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del rows
+    return {"bytesPerSample": bufferBytes / samples, "listBytesPerSample": listBytes / samples}
+
+
+def findRegressions(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for name, value in results.items():
+        if name not in baseline or name=="listBytesPerSample":
+            continue
+        if name in HIGHER_IS_BETTER:
+            worse = value < baseline[name] * (1 - tolerance)
+        else:
+            worse = value > baseline[name] * (1 + tolerance)
+        if worse:
+            regressions.append(f"{name}: {value:.6g} (baseline {baseline[name]:.6g})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark setpoint timing and polling against a simulated supply")
+    parser.add_argument("--latency", type=float, default=0.002, help="Simulated one-way I/O latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0005, help="Simulated latency jitter in seconds")
+    parser.add_argument("--points", type=int, default=500, help="Setpoints in the step timing run")
+    parser.add_argument("--step-time", type=float, default=0.01, help="Seconds per setpoint in the step timing run")
+    parser.add_argument("--duration", type=float, default=2, help="Seconds of polling to measure")
+    parser.add_argument("--trials", type=int, default=50, help="Setpoint changes in the latency run")
+    parser.add_argument("--samples", type=int, default=100000, help="Samples in the memory run")
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare the results with this JSON file")
+    parser.add_argument("--virtual", action="store_true", help="Run the step timing benchmark on a virtual clock")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed fraction a metric may get worse")
+    args = parser.parse_args()
+
+    instrumentOptions = {"latency": args.latency, "jitter": args.jitter}
+    results = {}
+    results.update(benchmarkStepTiming(instrumentOptions, args.points, args.step_time, args.virtual))
+    results.update(benchmarkPolling(instrumentOptions, args.duration))
+    results.update(benchmarkSetpointLatency(instrumentOptions, args.trials))
+    results.update(benchmarkMemory(args.samples))
+    for name, value in results.items():
+        print(f"{name:>22}: {value:.6g}")
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+    if args.baseline is not None:
+        with open(args.baseline, "r") as file:
+            regressions = findRegressions(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print("Regression in " + regression)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,64 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class Clock:
+    # Real time; schedulers and simulated instruments take a clock so that a VirtualClock can stand in for it
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+    async def sleepAsync(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+    def isVirtual(self) -> bool:
+        return False
+
+
+REAL_CLOCK = Clock()
+
+
+class VirtualClock(Clock):
+    # Time that only moves when something sleeps, so a profile runs as fast as the code allows; with speed it is paced
+    # at that many times real time instead. Callbacks given to callAt() run when a sleep passes their time.
+    # Only one thread may sleep on it.
+    def __init__(self, start: float = 0.0, speed: float = None):
+        self._now = start
+        self._speed = speed
+        self._timers = []  # Heap of (time, order, callback)
+        self._order = itertools.count()  # Keeps callbacks due at the same time in the order they were added
+        self._firing = False
+        self._realStart = time.monotonic()
+        self._virtualStart = start
+
+    def monotonic(self) -> float:
+        return self._now
+
+    def isVirtual(self) -> bool:
+        return True
+
+    def callAt(self, timestamp: float, callback):
+        heapq.heappush(self._timers, (timestamp, next(self._order), callback))
+
+    def sleep(self, seconds: float):
+        target = self._now + max(seconds, 0.0)
+        if not self._firing:  # Sleeps inside a callback, such as simulated I/O latency, just move time on
+            self._firing = True
+            try:
+                while len(self._timers) > 0 and self._timers[0][0] <= target:
+                    timestamp, order, callback = heapq.heappop(self._timers)
+                    self._now = max(self._now, timestamp)
+                    callback()
+            finally:
+                self._firing = False
+        self._now = max(self._now, target)
+        if self._speed is not None:
+            time.sleep(max(self._realStart + (self._now - self._virtualStart) / self._speed - time.monotonic(), 0))
+
+    async def sleepAsync(self, seconds: float):
+        self.sleep(seconds)
+        await asyncio.sleep(0)
@@ -0,0 +1,221 @@
+import csv
+import json
+import os
+import queue
+import shutil
+import time
+import zipfile
+from threading import Thread
+
+PARTIAL_SUFFIX = ".partial"  # Marks files whose run has not finished yet
+DEFAULT_FLUSH_INTERVAL = 1.0  # Seconds between forced writes to disk
+MAX_PENDING_BATCHES = 10000  # Writers block instead of growing memory if the disk falls this far behind
+NPZ_CHUNK_ROWS = 65536  # Rows per compressed chunk of each column in an NPZ file
+METADATA_MEMBER = "metadata.json"
+NPZ_PART_PREFIX = "part-"  # Rows an NPZ file received up to a flush, kept in its partial directory until it is packed
+
+_FINISH = object()
+
+
+class CSVFormat:
+    extension = ".csv"
+
+    def __init__(self, path: str, header: list):
+        self._path = path
+        self._file = open(path, "w", newline="")
+        self._writer = csv.writer(self._file, delimiter=",")
+        self._writer.writerow(header)
+
+    def writeRows(self, rows: list):
+        self._writer.writerows(rows)
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())  # Make sure the rows survive a crash or power loss
+
+    def close(self, metadata: dict, path: str):
+        self._file.close()
+        if metadata is not None:  # Text files keep their metadata next to them
+            with open(os.path.splitext(path)[0] + "-metadata.json", "w") as file:
+                json.dump(metadata, file, indent=4)
+        os.replace(self._path, path)
+
+
+class NPZFormat:
+    # Columnar and compressed; every column is stored as float64 chunks named "<column>/<chunk number>", see readNPZ().
+    # A zip is only readable once its index is written, so until close() the rows go into a directory at the partial
+    # path instead, one .npy part per flush. A crash loses at most one flush interval; packNPZ() recovers the rest.
+    extension = ".npz"
+
+    def __init__(self, path: str, header: list):
+        try:
+            import numpy
+        except ImportError:
+            raise ValueError("NumPy is needed to write .npz data files")
+        self._numpy = numpy
+        self._path = path
+        self._header = header
+        self._pending = []
+        self._partCount = 0
+        if os.path.isfile(path):  # The empty file claimFileName() reserved the name with
+            os.remove(path)
+        os.mkdir(path)
+        _writeMetadata(path, {"columns": header})
+
+    def writeRows(self, rows: list):
+        self._pending.extend(rows)
+        if len(self._pending) >= NPZ_CHUNK_ROWS:
+            self._writePart()
+
+    def _writePart(self):
+        if len(self._pending)==0:
+            return
+        table = self._numpy.array(self._pending, dtype=self._numpy.float64).reshape(len(self._pending), len(self._header))
+        partPath = os.path.join(self._path, f"{NPZ_PART_PREFIX}{self._partCount:06d}.npy")
+        with open(partPath + ".tmp", "wb") as file:  # Renamed once complete, so that a crash never leaves half a part
+            self._numpy.lib.format.write_array(file, table)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(partPath + ".tmp", partPath)
+        self._pending = []
+        self._partCount += 1
+
+    def flush(self):
+        self._writePart()
+
+    def close(self, metadata: dict, path: str):
+        self._writePart()
+        _writeMetadata(self._path, {**(metadata or {}), "columns": self._header})
+        packNPZ(self._path, path)
+
+
+def _writeMetadata(partialPath: str, metadata: dict):
+    with open(os.path.join(partialPath, METADATA_MEMBER), "w") as file:
+        json.dump(metadata, file)
+
+
+def packNPZ(partialPath: str, path: str):
+    # Packs the parts in an NPZ file's partial directory, such as one left behind by a crash, into the file at path
+    import numpy
+    with open(os.path.join(partialPath, METADATA_MEMBER), "r") as file:
+        metadata = json.load(file)
+    parts = sorted(name for name in os.listdir(partialPath) if name.startswith(NPZ_PART_PREFIX) and name.endswith(".npy"))
+    packedPath = os.path.join(partialPath, os.path.basename(path))
+    with open(packedPath, "wb") as file:
+        with zipfile.ZipFile(file, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            chunk = []
+            chunkRows = 0
+            chunkCount = 0
+            for index, part in enumerate(parts):  # Parts are gathered into chunks of about NPZ_CHUNK_ROWS rows
+                chunk.append(numpy.load(os.path.join(partialPath, part)))
+                chunkRows += len(chunk[-1])
+                if chunkRows < NPZ_CHUNK_ROWS and index < len(parts) - 1:
+                    continue
+                table = numpy.concatenate(chunk)
+                for column, name in enumerate(metadata["columns"]):
+                    with archive.open(f"{name}/{chunkCount:05d}.npy", "w") as member:
+                        numpy.lib.format.write_array(member, numpy.ascontiguousarray(table[:, column]))
+                chunk = []
+                chunkRows = 0
+                chunkCount += 1
+            archive.writestr(METADATA_MEMBER, json.dumps(metadata))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(packedPath, path)
+    shutil.rmtree(partialPath)
+
+
+FORMATS = {"csv": CSVFormat, "npz": NPZFormat}
+
+
+def claimFileName(base: str, extensions: list) -> str:
+    # Returns base, numbered if needed, so that no file with it and any of the extensions exists;
+    # the first extension's partial file is created to reserve the name
+    number = 1
+    while True:
+        name = base if number==1 else f"{base}-{number}"
+        if not any(os.path.exists(name + extension) for extension in extensions):
+            try:
+                os.close(os.open(name + extensions[0] + PARTIAL_SUFFIX, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return name
+            except FileExistsError:
+                pass
+        number += 1
+
+
+def readNPZ(path: str) -> (dict, dict):
+    # Returns the columns of an NPZ data file as whole arrays, and its metadata
+    import numpy
+    with numpy.load(path) as archive:
+        metadata = json.loads(archive[METADATA_MEMBER])
+        columns = {}
+        for name in metadata["columns"]:
+            chunks = sorted(key for key in archive.files if key.startswith(name + "/"))
+            columns[name] = numpy.concatenate([archive[key] for key in chunks]) if len(chunks) > 0 else numpy.empty(0)
+    return columns, metadata
+
+
+class DataWriter(Thread):
+    # onError(error) is called from the writer thread if the file cannot be written; rows given after that are dropped
+    # and the file keeps its partial suffix
+    def __init__(self, path: str, header: list, flushInterval: float = DEFAULT_FLUSH_INTERVAL, dataFormat: str = "csv",
+            onError=lambda error: None):
+        super().__init__()
+        self.daemon = True
+        self.path = path
+        self.rowCount = 0
+        self.error = None
+        self._onError = onError
+        self._partialPath = path + PARTIAL_SUFFIX
+        self._flushInterval = flushInterval
+        self._queue = queue.Queue(maxsize=MAX_PENDING_BATCHES)
+        self._format = FORMATS[dataFormat](self._partialPath, header)
+        self._metadata = None
+        self.start()
+
+    def write(self, row):
+        if self.error is None:
+            self._queue.put([row])
+
+    def writeRows(self, rows: list):
+        if self.error is None:
+            self._queue.put(rows)
+
+    def setMetadata(self, metadata: dict):
+        # Stored with the data when the file is finished
+        self._metadata = metadata
+
+    def _takeBatch(self, timeout: float) -> (list, bool):
+        batch = []
+        try:
+            item = self._queue.get(timeout=max(timeout, 0))
+            while True:
+                if item is _FINISH:
+                    return batch, True
+                batch.extend(item)
+                item = self._queue.get_nowait()
+        except queue.Empty:
+            return batch, False
+
+    def run(self):
+        lastFlush = time.monotonic()
+        finished = False
+        try:
+            while not finished:
+                batch, finished = self._takeBatch(lastFlush + self._flushInterval - time.monotonic())
+                self._format.writeRows(batch)
+                self.rowCount += len(batch)
+                if finished or time.monotonic() - lastFlush >= self._flushInterval:
+                    self._format.flush()
+                    lastFlush = time.monotonic()
+            self._format.close(self._metadata, self.path)  # Also moves the file from its partial path to path
+        except Exception as error:  # Disk full, permissions, unencodable values...
+            self.error = error
+            self._onError(error)
+            if not finished:
+                while self._queue.get() is not _FINISH:  # Keep writers from blocking on a full queue until finish()
+                    pass
+
+    def finish(self):
+        self._queue.put(_FINISH)
+        self.join()
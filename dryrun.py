@@ -0,0 +1,155 @@
+from concurrent.futures import Future
+
+from asyncpowersupply import (DEFAULT_FAST_POLL_PERIOD, DEFAULT_FAST_POLL_WINDOW, DEFAULT_POLL_PERIOD, MEASURE_ALL_QUERY,
+    Measurement, Setpoint, adaptivePollPeriod)
+from clock import VirtualClock
+from metrics import Metrics
+from simulatedsupply import SimulatedInstrument
+
+MIN_POLL_PERIOD = 0.001  # Dry run polls are at least this far apart, so that virtual time always moves on
+
+
+def _done(result=None) -> Future:
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class DryRunSupply:
+    # Stands in for PowerSupply in dry runs: a SimulatedInstrument on a VirtualClock, polled from the clock's callbacks.
+    # Everything runs on the thread that sleeps on the clock, so a profile takes only as long as its computation.
+    def __init__(self, clock: VirtualClock = None, pollPeriod: float = DEFAULT_POLL_PERIOD,
+            fastPollWindow: float = DEFAULT_FAST_POLL_WINDOW, fastPollPeriod: float = DEFAULT_FAST_POLL_PERIOD,
+            **instrumentOptions):
+        # Polls like PowerSupply with the same settings, so that a dry run records as many samples in the same places
+        self._clock = VirtualClock() if clock is None else clock
+        self._instr = SimulatedInstrument(clock=self._clock, **instrumentOptions)
+        self._pollPeriod = pollPeriod
+        self._fastPollWindow = fastPollWindow
+        self._fastPollPeriod = fastPollPeriod
+        self._pollToken = 0  # Only the newest scheduled poll runs, so that a setpoint can bring the next one forward
+        self._metrics = Metrics()
+        self._currentLimit = None
+        self._targetVoltage = 0
+        self._targetCurrent = 0
+        self._measurement = Measurement(0, self._clock.monotonic(), 0, 0, 0)
+        self._setpoint = Setpoint(0, self._clock.monotonic(), 0)
+        self._onUpdate = None
+        self._IDN = self._query("*IDN?")
+        self._write("CURR 0\n")  # The same start as a real connection
+        self._write("INP:START\n")
+        self._metrics.count("connects")
+        self._schedulePoll(self._clock.monotonic() + self._pollPeriod)
+
+    def getClock(self) -> VirtualClock:
+        return self._clock
+
+    def onUpdate(self, onUpdate):
+        # onUpdate(lastMeasurement, lastSetpoint, measurement, setpoint) is called for every new measurement or setpoint
+        self._onUpdate = onUpdate
+
+    def _timed(self, name: str, call):
+        before = self._clock.monotonic()
+        try:
+            return call()
+        finally:
+            self._metrics.histogram(name).record(self._clock.monotonic() - before)
+
+    def _write(self, command: str):
+        self._timed(command.strip().split(" ")[0], lambda: self._instr.write(command))
+
+    def _query(self, query: str) -> str:
+        return self._timed(query.strip().split(" ")[0], lambda: self._instr.query(query))
+
+    def _publish(self, measurement: Measurement, setpoint: Setpoint):
+        lastMeasurement, lastSetpoint = self._measurement, self._setpoint
+        self._measurement, self._setpoint = measurement, setpoint
+        if self._onUpdate is not None:
+            self._onUpdate(lastMeasurement, lastSetpoint, measurement, setpoint)
+
+    def _schedulePoll(self, timestamp: float):
+        self._pollToken += 1
+        token = self._pollToken
+        self._clock.callAt(timestamp, lambda: self._poll() if token==self._pollToken else None)
+
+    def _poll(self):
+        pollStart = self._clock.monotonic()
+        voltage, current, power = (float(value) for value in self._query(MEASURE_ALL_QUERY).split(";"))
+        self._publish(Measurement(self._measurement.sequence + 1, (pollStart + self._clock.monotonic()) / 2, voltage,
+            current, power), self._setpoint)
+        pollPeriod = adaptivePollPeriod(self._clock.monotonic() - self._setpoint.timestamp, self._pollPeriod,
+            self._fastPollWindow, self._fastPollPeriod)
+        self._schedulePoll(pollStart + max(pollPeriod, MIN_POLL_PERIOD))
+
+    def _publishSetpoint(self, voltage: float):
+        self._publish(self._measurement, Setpoint(self._setpoint.sequence + 1, self._clock.monotonic(), voltage))
+        if self._fastPollWindow > 0:
+            self._schedulePoll(self._clock.monotonic())  # Start the fast polling now, as PowerSupply does
+
+    def getIDN(self):
+        return self._IDN
+
+    def getMetrics(self) -> Metrics:
+        return self._metrics
+
+    def setAdaptivePolling(self, fastPollWindow: float, fastPollPeriod: float = DEFAULT_FAST_POLL_PERIOD):
+        self._fastPollWindow = fastPollWindow
+        self._fastPollPeriod = fastPollPeriod
+
+    def isConnected(self):
+        return True
+
+    def kill(self):
+        self._write("INP:STOP\n")
+
+    def applyCurrentLimit(self, limit) -> Future:
+        self._currentLimit = limit
+        self._write(f"SOUR:CURR {limit}\n")
+        return _done()
+
+    def setVoltage(self, voltage: float) -> Future:
+        self._targetVoltage = voltage
+        self._write(f"VOLT {voltage}\n")
+        self._publishSetpoint(voltage)
+        return _done(True)
+
+    def setCurrent(self, current: float) -> Future:
+        self._targetCurrent = current
+        self._write(f"CURR {current}\n")
+        return _done()
+
+    def setOutputHeld(self, held: bool) -> Future:
+        return _done()  # The simulated link never drops, so there is nothing to restore
+
+    def getMeasurement(self) -> Measurement:
+        return self._measurement
+
+    def getSetpoint(self) -> Setpoint:
+        return self._setpoint
+
+    def publishTargetVoltage(self, voltage: float):
+        self._targetVoltage = voltage
+        self._publishSetpoint(voltage)
+
+    def waitForUpdate(self, measurementSequence: int, setpointSequence: int, timeout: float = None) -> (Measurement, Setpoint):
+        # Nothing else runs while the caller waits, so there is never anything newer to wait for
+        return self._measurement, self._setpoint
+
+    def getCurrentLimit(self):
+        return self._currentLimit
+
+    def getTargetVoltage(self):
+        return self._targetVoltage
+
+    def getTargetCurrent(self):
+        return self._targetCurrent
+
+    def writeCommand(self, command: str) -> Future:
+        self._write(command)
+        return _done()
+
+    def requestQuery(self, query: str) -> Future:
+        return _done(self._query(query))
+
+    def query(self, query: str):
+        return self._query(query)
@@ -0,0 +1,89 @@
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+from threading import Thread
+
+# Lower numbers are sent first
+SETPOINT_PRIORITY = 0
+CONTROL_PRIORITY = 1
+TELEMETRY_PRIORITY = 2
+_STOP_PRIORITY = 3
+
+_STOP = object()
+
+
+class InstrumentWorker(Thread):
+    # Runs every job that touches an instrument on one thread so that writes and reads can never interleave
+    def __init__(self):
+        super().__init__()
+        self.daemon = True
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._latest = {}  # Coalesce key -> (sequence, future) of the newest job waiting under that key
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def submit(self, job, priority: int = CONTROL_PRIORITY, coalesceKey: str = None) -> Future:
+        # Jobs that share a coalesceKey replace each other, so only the newest waiting one is run
+        future = Future()
+        if self._stopped:
+            future.cancel()
+            return future
+        sequence = next(self._sequence)
+        if coalesceKey is not None:
+            with self._lock:
+                self._latest[coalesceKey] = (sequence, future)
+        self._queue.put((priority, sequence, job, future, coalesceKey))
+        return future
+
+    def _isSuperseded(self, sequence: int, future: Future, coalesceKey: str) -> bool:
+        with self._lock:
+            latestSequence, latestFuture = self._latest[coalesceKey]
+            if latestSequence==sequence:
+                del self._latest[coalesceKey]
+                return False
+        # Skipped jobs finish together with the job that replaced them
+        latestFuture.add_done_callback(lambda done: _copyResult(done, future))
+        return True
+
+    def run(self):
+        while True:
+            priority, sequence, job, future, coalesceKey = self._queue.get()
+            if job is _STOP:
+                break
+            if coalesceKey is not None and self._isSuperseded(sequence, future, coalesceKey):
+                continue
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(job())
+            except BaseException as e:
+                future.set_exception(e)
+        self._cancelPending()
+
+    def _cancelPending(self):
+        while True:
+            try:
+                future = self._queue.get_nowait()[3]
+            except queue.Empty:
+                break
+            if future is not None:
+                future.cancel()
+
+    def stop(self):
+        # Jobs already waiting are still run, anything submitted afterwards is cancelled
+        self._stopped = True
+        self._queue.put((_STOP_PRIORITY, next(self._sequence), _STOP, None, None))
+
+
+def _copyResult(source: Future, target: Future):
+    if source.cancelled():
+        target.cancel()
+    elif not target.set_running_or_notify_cancel():
+        return
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
@@ -0,0 +1,73 @@
+import time
+
+from asyncpowersupply import getEventLoop
+from powersupplyexp import PowerSupply
+
+DEFAULT_LEAD_TIME = 0.5  # Seconds given to every experiment to load its profile before a synchronized start
+
+
+class InstrumentManager:
+    # Holds named power supplies and the experiments running on them; all of them are polled from one event loop
+    def __init__(self, loop=None):
+        self._loop = getEventLoop() if loop is None else loop
+        self._powerSupplies = {}
+        self._experiments = {}
+
+    def connect(self, name: str, resourceName: str, **kwargs) -> PowerSupply:
+        return self.add(name, PowerSupply(resourceName, loop=self._loop, **kwargs)).tryConnect()
+
+    def add(self, name: str, powerSupply):
+        # Takes over a supply made elsewhere, such as a DryRunSupply
+        self.disconnect(name)
+        self._powerSupplies[name] = powerSupply
+        return powerSupply
+
+    def disconnect(self, name: str):
+        powerSupply = self._powerSupplies.pop(name, None)
+        if powerSupply is not None:
+            powerSupply.kill()
+
+    def getPowerSupply(self, name: str) -> PowerSupply:
+        return self._powerSupplies[name]
+
+    def getNames(self) -> list:
+        return list(self._powerSupplies)
+
+    def startExperiment(self, name: str, experiment):
+        self.startExperiments({name: experiment}, leadTime=0)
+
+    def startExperiments(self, experiments: dict, leadTime: float = DEFAULT_LEAD_TIME):
+        # Every experiment applies its first setpoint at the same moment of its clock, leadTime from now. Dry runs each
+        # have a virtual clock of their own, so the moment is taken once per clock.
+        startTimestamps = {}
+        for name, experiment in experiments.items():
+            previous = self._experiments.get(name)
+            if previous is not None and previous.is_alive():
+                raise RuntimeError(f"An experiment is already running on \"{name}\"")
+            clock = experiment.getClock()
+            if clock not in startTimestamps:
+                startTimestamps[clock] = clock.monotonic() + leadTime
+            self._experiments[name] = experiment
+            if len(self._powerSupplies) > 1:  # A lone instrument keeps the plain file names
+                experiment.setChannel(name)
+            experiment.scheduleStart(startTimestamps[clock])
+        for experiment in experiments.values():
+            experiment.start()
+
+    def getExperiment(self, name: str):
+        return self._experiments.get(name)
+
+    def waitForExperiments(self, timeout: float = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for experiment in list(self._experiments.values()):
+            experiment.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+
+    def killExperiments(self):
+        for experiment in self._experiments.values():
+            experiment.kill()
+
+    def shutdown(self):
+        self.killExperiments()
+        self.waitForExperiments()
+        for name in self.getNames():
+            self.disconnect(name)
@@ -0,0 +1,183 @@
+from itertools import islice
+
+from clock import REAL_CLOCK, Clock
+from scheduler import MAX_SLEEP, StepTiming
+
+DEFAULT_LIST_LENGTH = 512  # Points the instrument's list memory can hold at once
+DEFAULT_PROGRESS_PERIOD = 0.05  # Seconds between progress queries while a list is running
+STALL_TIMEOUT = 1.0  # Seconds past a chunk's planned end after which an instrument that stopped stepping is given up on
+
+# Common list-mode SCPI syntax; instruments that spell these differently only need this table changed
+LIST_COMMANDS = {
+    "voltages": "LIST:VOLT {}\n",
+    "dwells": "LIST:DWEL {}\n",
+    "count": "LIST:COUN 1\n",
+    "listMode": "VOLT:MODE LIST\n",
+    "fixedMode": "VOLT:MODE FIX\n",
+    "triggerSource": "TRIG:SOUR BUS\n",
+    "initiate": "INIT\n",
+    "trigger": "*TRG\n",
+    "abort": "ABOR\n",
+    "step": "LIST:STEP?\n",  # Index of the running step; the list length once the list has finished
+    "clearErrors": "*CLS\n",
+    "error": "SYST:ERR?\n"  # Oldest entry of the error queue, as "<code>,\"<message>\"", code 0 when it is empty
+}
+
+
+class ListModeError(RuntimeError):
+    # The instrument rejected the list, stopped running it, or could no longer be reached
+    pass
+
+
+class ListModeRunner:
+    # Runs a profile from the instrument's list memory so that step timing comes from the instrument's own clock
+    def __init__(self, powerSupply, steps, isActive=lambda: True, onStep=lambda step: None,
+            listLength: int = DEFAULT_LIST_LENGTH, progressPeriod: float = DEFAULT_PROGRESS_PERIOD,
+            clock: Clock = REAL_CLOCK):
+        self._powerSupply = powerSupply
+        self._clock = clock
+        self._steps = steps  # Iterable of (voltage, duration) pairs, consumed one chunk at a time
+        self._isActive = isActive
+        self._onStep = onStep
+        self._listLength = listLength
+        self._progressPeriod = progressPeriod
+
+    def _write(self, command: str):
+        import pyvisa
+        try:
+            self._powerSupply.writeCommand(command).result()
+        except pyvisa.errors.Error as error:
+            raise ListModeError(f"{command.strip()} failed: {error}")
+        if not self._powerSupply.isConnected():  # A disconnected supply drops writes without a word
+            raise ListModeError("The connection to the instrument was lost while running the list")
+
+    def _query(self, query: str) -> str:
+        import pyvisa
+        try:
+            answer = self._powerSupply.query(query)
+        except pyvisa.errors.Error as error:
+            raise ListModeError(f"{query.strip()} failed: {error}")
+        if answer is None:
+            raise ListModeError("The connection to the instrument was lost while running the list")
+        return answer
+
+    def _checkErrors(self):
+        code, _, message = self._query(LIST_COMMANDS["error"]).strip().partition(",")
+        try:
+            failed = int(code) != 0
+        except ValueError:
+            failed = True
+        if failed:
+            raise ListModeError(f"The instrument rejected the list: {code},{message}")
+
+    def _upload(self, chunk: list):
+        # Everything but the dwells, which are written last so that they can make up for the time the upload took
+        self._write(LIST_COMMANDS["clearErrors"])
+        self._write(LIST_COMMANDS["voltages"].format(",".join(str(voltage) for voltage, duration in chunk)))
+        self._write(LIST_COMMANDS["count"])
+        self._write(LIST_COMMANDS["listMode"])
+        self._write(LIST_COMMANDS["triggerSource"])
+
+    def _currentStep(self) -> int:
+        answer = self._query(LIST_COMMANDS["step"])
+        try:
+            return int(float(answer))
+        except ValueError:
+            raise ListModeError(f"The instrument answered {LIST_COMMANDS['step'].strip()} with \"{answer.strip()}\"")
+
+    def _waitUntil(self, timestamp: float) -> bool:
+        while self._isActive():
+            remaining = timestamp - self._clock.monotonic()
+            if remaining <= 0:
+                return True
+            self._clock.sleep(min(remaining, MAX_SLEEP))
+        return False
+
+    def _monitor(self, chunk: list, dwells: list, first: int, chunkOffset: float, chunkStart: float,
+            runStart: float) -> bool:
+        # A step only counts once the instrument reports it. It started after the query before that report was sent and
+        # before the report arrived; within that window the dwells, timed by the instrument itself, say when.
+        offsets = [0.0]
+        plannedOffsets = [0.0]
+        for dwell, (voltage, duration) in zip(dwells, chunk):
+            offsets.append(offsets[-1] + dwell)
+            plannedOffsets.append(plannedOffsets[-1] + duration)
+        step = -1
+        lastAsked = chunkStart
+        while self._isActive():
+            asked = self._clock.monotonic()
+            current = self._currentStep()
+            answered = self._clock.monotonic()
+            for passed in range(step + 1, min(current + 1, len(chunk))):
+                voltage = chunk[passed][0]
+                plannedTime = chunkOffset + plannedOffsets[passed]
+                achievedTime = min(max(chunkStart + offsets[passed], lastAsked), answered) - runStart
+                self._powerSupply.publishTargetVoltage(voltage)
+                self._onStep(StepTiming(first + passed, voltage, plannedTime, achievedTime, achievedTime - plannedTime))
+            step = max(step, min(current, len(chunk) - 1))
+            lastAsked = asked
+            # Some instruments stay on the last step instead of counting past it; theirs ends with its dwell
+            if current >= len(chunk) or (step == len(chunk) - 1 and answered >= chunkStart + offsets[-1]):
+                return True
+            if answered > chunkStart + offsets[-1] + STALL_TIMEOUT:
+                raise ListModeError(f"The instrument stopped on step {first + step + 1} of the list")
+            self._clock.sleep(min(self._progressPeriod, MAX_SLEEP))
+        return False
+
+    def run(self, startTime: float = None) -> bool:
+        # Raises ListModeError if the list could not be run; the instrument is put back into fixed mode first
+        try:
+            if self._run(startTime):
+                self._write(LIST_COMMANDS["fixedMode"])
+                return True
+        except ListModeError:
+            self._stop()
+            raise
+        self._stop()
+        return False
+
+    def _stop(self):
+        try:
+            self._write(LIST_COMMANDS["abort"])
+            self._write(LIST_COMMANDS["fixedMode"])
+        except ListModeError:  # Reconnecting leaves the instrument in fixed mode anyway
+            pass
+
+    def _run(self, startTime: float) -> bool:
+        runStart = self._clock.monotonic() if startTime is None else startTime
+        steps = iter(self._steps)
+        first = 0
+        chunkOffset = 0.0
+        armTime = 0.0  # Seconds from writing the dwells to the trigger, as measured on the previous chunk
+        chunk = list(islice(steps, self._listLength))
+        while len(chunk) > 0:
+            self._upload(chunk)  # Profiles longer than the list memory are run one chunk at a time
+            # The output holds the previous chunk's last voltage during the upload; that gap is taken off this chunk's
+            # first dwells so that the uploads do not add up over the profile
+            if not self._waitUntil(runStart + chunkOffset - armTime):
+                return False
+            dwells = _shortened([duration for voltage, duration in chunk],
+                self._clock.monotonic() + armTime - runStart - chunkOffset)
+            before = self._clock.monotonic()
+            self._write(LIST_COMMANDS["dwells"].format(",".join(str(dwell) for dwell in dwells)))
+            self._write(LIST_COMMANDS["initiate"])
+            self._checkErrors()  # Before the trigger, so that a rejected list is never run
+            self._write(LIST_COMMANDS["trigger"])
+            chunkStart = self._clock.monotonic()
+            armTime = chunkStart - before
+            if not self._monitor(chunk, dwells, first, chunkOffset, chunkStart, runStart):
+                return False
+            first += len(chunk)
+            chunkOffset += sum(duration for voltage, duration in chunk)
+            chunk = list(islice(steps, self._listLength))
+        return True
+
+
+def _shortened(dwells: list, lateness: float) -> list:
+    # Takes lateness seconds off the first dwells, emptying as many as it needs
+    shortened = []
+    for dwell in dwells:
+        cut = min(max(lateness, 0.0), dwell)
+        shortened.append(dwell - cut)
+        lateness -= cut
+    return shortened
@@ -6,23 +6,41 @@ Mentor: Dr. Steve Adams
 Location: Wright-Patterson Air Force Base
 """
 import json
+import multiprocessing
 import os
 from tkinter import messagebox
 from tkinter.filedialog import askdirectory
 from tkinter.filedialog import askopenfilename
 
-from powersupplyexp import PowerSupply, Experiment, killActiveExperiment
+from acquisition import AcquisitionProcess
+from metrics import formatSnapshot
+from powersupplyexp import PowerSupply, Experiment, getActiveExp, getActivePowerSupply, killActiveExperiment
+from setpointsource import SETPOINT_FILE_TYPES
+from stripchart import StripChart
 from tkutils import *
+from visaresources import scanResources
 
 DEFAULT_SETTINGS = {
     "machineAddress": "TCPIP0::169.254.197.112::inst0::INSTR",
     "fileURI": "",
     "dataStoragePath": "",
     "testTime": 10,
-    "resetVoltage": True
+    "resetVoltage": True,
+    "interpolate": False,
+    "listMode": False,
+    "listLength": 512,
+    "pollPeriod": 0.1,
+    "fastPollWindow": 0.5,
+    "fastPollPeriod": 0.0,
+    "readoutFrameRate": 20,
+    "dataFormat": "csv",
+    "maxVoltage": None,  # Top of the supply's range in volts, if setpoints above it should be clamped
+    "flushInterval": 1.0,  # Seconds between writes of the data to disk, which bounds what a crash can lose
+    "acquisitionProcess": False  # Run the supply and experiments in a separate process that the window cannot slow
 }
 
 currentLimit = 30
+metricsRefreshPeriod = 1000  # Milliseconds between refreshes of the metrics window
 
 settingsDir = "./settings"
 settingsFileName = "settings.json"
@@ -30,7 +48,15 @@ settingsFileName = "settings.json"
 
 def main():
     def newPowerSupply(addr: str):
-        powerSupply = PowerSupply(addr, autoConnect=False)
+        if acquisition is not None:
+            connectionStatus.set("Disconnected")
+            acquisition.connect(addr, currentLimit, pollPeriod=float(settings["pollPeriod"]),
+                fastPollWindow=float(settings["fastPollWindow"]), fastPollPeriod=float(settings["fastPollPeriod"]))
+            return
+        if getActivePowerSupply() is not None:
+            getActivePowerSupply().kill()  # The window drives one supply at a time
+        powerSupply = PowerSupply(addr, autoConnect=False, pollPeriod=float(settings["pollPeriod"]),
+            fastPollWindow=float(settings["fastPollWindow"]), fastPollPeriod=float(settings["fastPollPeriod"]))
 
         def onPowerSupplyConnect():
             window.after(0, lambda: connectionStatus.set(f"Connected to {powerSupply.getIDN()}"))
@@ -44,12 +70,35 @@ def main():
 
         powerSupply.onConnect(onPowerSupplyConnect)
         powerSupply.onDisconnect(onPowerSupplyDisconnect)
+        powerSupply.onError(lambda title, message: window.after(0, lambda: messagebox.showerror(title, message=message)))
         powerSupply.tryConnect()
 
+    def scanForSupplies():
+        scanButton.config(state=tk.DISABLED)
+        scanText.set("Scanning...")
+        scanResources(lambda found: window.after(0, lambda: showScanResults(found)))
+
+    def showScanResults(found: list):
+        scanButton.config(state=tk.NORMAL)
+        scanText.set("Scan")
+        if len(found)==0:
+            messagebox.showinfo("Scan", message="No instruments were found.")
+            return
+
+        def choose(resourceName: str):
+            machineAddr.set(resourceName)
+            newPowerSupply(resourceName)
+
+        menu = tk.Menu(window, tearoff=0)
+        for resourceName, idn in found:
+            menu.add_command(label=resourceName if idn is None else f"{idn} ({resourceName})",
+                command=lambda resourceName=resourceName: choose(resourceName))
+        menu.tk_popup(scanButton.winfo_rootx(), scanButton.winfo_rooty() + scanButton.winfo_height())
+
     def startNewExp():
         if not os.path.isfile(filePath.get()):
             if messagebox.askretrycancel("Invalid path", icon=messagebox.ERROR, message="The experiment could not be started because the provided path to the setpoint file is invalid."):
-                filePath.set(askopenfilename(filetypes=[("CSV Files", ".csv")]))
+                filePath.set(askopenfilename(filetypes=SETPOINT_FILE_TYPES))
                 startNewExp()
             return
         try:
@@ -57,33 +106,141 @@ def main():
         except ValueError:
             messagebox.showerror("Invalid run time", message="The provided value for the experiment run time is not a number.")
             return
+        if not os.path.isdir(folderPath.get()):
+            folderPath.set(askdirectory(title="Data storage directory"))
+            if not os.path.isdir(folderPath.get()):
+                messagebox.showerror("Invalid path", message="The experiment could not be started because no data storage directory was chosen.")
+                return
         expSettings = {
-            "filePathStringVar": filePath,
-            "folderPathStringVar": folderPath,
-            "runTimeStringVar": timeInput,
-            "endAtZeroBoolVar": resetVoltage,
-            "voltageReadout": targetVoltageReadout,
-            "timeReadout": elapsedTimeReadout,
-            "progressReadout": progressReadout,
-            "actualVoltageReadout": actualVoltageReadout,
-            "actualCurrentReadout": actualCurrentReadout,
-            "powerReadout": powerReadout,
-            "onFinish": abortExp
+            "setpointPath": filePath.get(),
+            "dataFolder": folderPath.get(),
+            "runTime": float(timeInput.get()),
+            "endAtZero": resetVoltage.get(),
+            "interpolate": interpolate.get(),
+            "listMode": listMode.get(),
+            "listLength": int(settings["listLength"]),
+            "dataFormat": settings["dataFormat"],
+            "flushInterval": float(settings["flushInterval"]),
+            "maxVoltage": None if settings["maxVoltage"] is None else float(settings["maxVoltage"])
         }
-        Experiment(**expSettings).start()
         abortExpBtn.place(relx=0.5, y=450, anchor=tk.CENTER)
         startExp.place_forget()
+        if acquisition is not None:
+            acquisition.startExperiment(**expSettings)
+            stripChart.setSource(acquisition.getSamples())
+            return
+        expSettings.update({
+            "onSetpoint": targetVoltageReadout.update,
+            "onProgress": showProgress,
+            "onMeasurement": showMeasurement,
+            "onSamples": stripChart.setSource,
+            "onStart": lambda: progressReadout.recolor(BLUE),
+            "onComplete": showCompletion,
+            "onError": lambda title, message: window.after(0, lambda: messagebox.showerror(title, message=message)),
+            "onFinish": abortExp,
+            "onPause": lambda: progressReadout.recolor(PAUSED_YELLOW),
+            "onResume": lambda: progressReadout.recolor(BLUE)
+        })
+        Experiment(**expSettings).start()
+
+    def showProgress(elapsedTime: float, runTime: float):
+        elapsedTimeReadout.update("{:.2f}".format(min(elapsedTime, runTime)))
+        progressReadout.update("{:.2f}".format(min(100 * elapsedTime / runTime, 99)) + "%")
+
+    def showMeasurement(measurement):
+        actualVoltageReadout.update("{:.3f}".format(measurement.voltage))
+        actualCurrentReadout.update("{:.3f}".format(measurement.current))
+        powerReadout.update("{:.3f}".format(measurement.power))
+
+    def showCompletion(finished: bool):
+        progressReadout.recolor(FINISHED_GREEN)
+        if finished:
+            progressReadout.update("100.00%")
 
     def abortExp():
         killActiveExperiment()
+        if acquisition is not None:
+            acquisition.killExperiment()
         startExp.place(relx=0.5, y=450, anchor=tk.CENTER)
         abortExpBtn.place_forget()
 
+    def pumpAcquisition():
+        # Handles the acquisition process's events and shows its newest sample
+        for event in acquisition.events():
+            if event[0]=="connected":
+                connectionStatus.set(f"Connected to {event[1]}")
+            elif event[0]=="disconnected":
+                connectionStatus.set("Disconnected")
+            elif event[0]=="started":
+                acquisitionState["runTime"] = event[1]
+                acquisitionState["running"] = True
+                acquisitionState["shownCount"] = 0  # The run records into the buffer from the start
+                progressReadout.recolor(BLUE)
+            elif event[0]=="completed":
+                acquisitionState["running"] = False
+                showCompletion(event[1])
+            elif event[0]=="error":
+                messagebox.showerror(event[1], message=event[2])
+            elif event[0]=="paused":
+                progressReadout.recolor(PAUSED_YELLOW)
+            elif event[0]=="resumed":
+                progressReadout.recolor(BLUE)
+            elif event[0]=="finished":
+                acquisitionState["running"] = False
+                abortExp()
+            elif event[0]=="metrics":
+                acquisitionState["metrics"] = event[1]
+        samples = acquisition.getSamples()
+        if acquisitionState["running"] and samples.getCount() > acquisitionState["shownCount"]:
+            acquisitionState["shownCount"] = samples.getCount()
+            elapsedTime, targetVoltage, voltage, current, power = (column[0] for column in samples.latest(1))
+            targetVoltageReadout.update(targetVoltage)
+            if acquisitionState["runTime"] > 0:
+                showProgress(elapsedTime, acquisitionState["runTime"])
+            actualVoltageReadout.update("{:.3f}".format(voltage))
+            actualCurrentReadout.update("{:.3f}".format(current))
+            powerReadout.update("{:.3f}".format(power))
+        window.after(round(1000 / float(settings["readoutFrameRate"])), pumpAcquisition)
+
+    def showMetrics():
+        metricsWindow = tk.Toplevel(window)
+        metricsWindow.title("Metrics")
+        metricsWindow.config(background=GRAY)
+        metricsText = tk.StringVar()
+        tk.Label(metricsWindow, textvariable=metricsText, justify=tk.LEFT,
+            **{**DEFAULT_LABEL, "font": ("Consolas", 10)}).pack(padx=20, pady=20)
+
+        def refreshMetrics():
+            if not metricsWindow.winfo_exists():
+                return
+            sections = []
+            if acquisition is not None:
+                acquisition.requestMetrics()  # Shown on the next refresh
+                for name, snapshot in sorted(acquisitionState["metrics"].items()):
+                    sections.append(name.capitalize() + "\n" + formatSnapshot(snapshot))
+            if getActivePowerSupply() is not None:
+                sections.append("Instrument\n" + formatSnapshot(getActivePowerSupply().getMetrics().snapshot()))
+            if getActiveExp() is not None:
+                sections.append("Experiment\n" + formatSnapshot(getActiveExp().metrics.snapshot()))
+            metricsText.set("\n\n".join(sections))
+            metricsWindow.after(metricsRefreshPeriod, refreshMetrics)
+
+        refreshMetrics()
+
     def saveSettings():
         if not os.path.isdir(settingsDir):
             os.mkdir(settingsDir)
         with open(f"{settingsDir}/{settingsFileName}", "w") as file:
             toSave = DEFAULT_SETTINGS.copy()
+            toSave["pollPeriod"] = settings["pollPeriod"]
+            toSave["fastPollWindow"] = settings["fastPollWindow"]
+            toSave["fastPollPeriod"] = settings["fastPollPeriod"]
+            toSave["readoutFrameRate"] = settings["readoutFrameRate"]
+            toSave["listLength"] = settings["listLength"]
+            toSave["dataFormat"] = settings["dataFormat"]
+            toSave["flushInterval"] = settings["flushInterval"]
+            toSave["maxVoltage"] = settings["maxVoltage"]
+            toSave["acquisitionProcess"] = settings["acquisitionProcess"]
             if machineAddr.get()!="":
                 toSave["machineAddress"] = machineAddr.get()
             if os.path.isfile(filePath.get()):
@@ -95,24 +252,29 @@ def main():
                 toSave["testTime"] = timeInput.get()
             finally:
                 toSave["resetVoltage"] = resetVoltage.get()
+                toSave["interpolate"] = interpolate.get()
+                toSave["listMode"] = listMode.get()
             json.dump(toSave, file)
 
     def loadSettings():
         try:
             with open(f"{settingsDir}/{settingsFileName}", "r") as file:
-                return json.load(file)
+                return {**DEFAULT_SETTINGS, **json.load(file)}
         except (json.JSONDecodeError, FileNotFoundError):
             return DEFAULT_SETTINGS
 
     settings = loadSettings()
+    acquisition = AcquisitionProcess() if settings["acquisitionProcess"] else None
+    acquisitionState = {"runTime": 0.0, "running": False, "shownCount": 0, "metrics": {}}
 
     window = tk.Tk()
     window.iconbitmap("icon.ico")
     window.title("Power Supply Manager")
 
-    window.geometry("1300x800")
+    window.geometry("1300x1020")
     window.config(background=GRAY)
-    centerFrame = tk.Frame(window, width=1300, height=800, background=GRAY)
+    getReadoutBus().setFrameRate(float(settings["readoutFrameRate"]))
+    centerFrame = tk.Frame(window, width=1300, height=1020, background=GRAY)
 
     # Region connection status
     connectionStatus = tk.StringVar()
@@ -124,6 +286,8 @@ def main():
         "Machine address")
     makeTextWidget("Button", machineAddrChooserContainer, "Connect",
         command=lambda: newPowerSupply(machineAddr.get())).grid(row=0, column=2, padx=20)
+    scanButton, scanText = makeTextWidgetEx("Button", machineAddrChooserContainer, "Scan", command=scanForSupplies)
+    scanButton.grid(row=0, column=3)
     machineAddrChooserContainer.config(padx=20, pady=20, background=GRAY)
     machineAddrChooserContainer.place(relx=0.5, y=50, anchor=tk.CENTER)
     # End region
@@ -131,7 +295,7 @@ def main():
     # Region file chooser
     fileChooserContainer, filePath = entryLabelCombo(centerFrame, settings["fileURI"], 90, "Setpoint file path")
     makeTextWidget("Button", fileChooserContainer, "Choose file",
-        command=lambda: filePath.set(askopenfilename(filetypes=[("CSV Files", ".csv")]))).grid(row=0,
+        command=lambda: filePath.set(askopenfilename(filetypes=SETPOINT_FILE_TYPES))).grid(row=0,
         column=2,
         padx=20)
     fileChooserContainer.config(padx=20, pady=20, background=GRAY)
@@ -157,7 +321,21 @@ def main():
     checkContainer, resetVoltage = entryCheckButtonCombo(centerFrame, "Set voltage to zero at experiment end")
     resetVoltage.set(bool(settings["resetVoltage"]))
     checkContainer.config(background=GRAY)
-    checkContainer.place(relx=0.5, y=365, anchor=tk.CENTER)
+    checkContainer.place(relx=0.2, y=365, anchor=tk.CENTER)
+    # End region
+
+    # Region interpolate checkbox
+    interpolateContainer, interpolate = entryCheckButtonCombo(centerFrame, "Interpolate between setpoints")
+    interpolate.set(bool(settings["interpolate"]))
+    interpolateContainer.config(background=GRAY)
+    interpolateContainer.place(relx=0.5, y=365, anchor=tk.CENTER)
+    # End region
+
+    # Region list mode checkbox
+    listModeContainer, listMode = entryCheckButtonCombo(centerFrame, "Run from instrument list memory")
+    listMode.set(bool(settings["listMode"]))
+    listModeContainer.config(background=GRAY)
+    listModeContainer.place(relx=0.8, y=365, anchor=tk.CENTER)
     # End region
 
     # Region progress readout
@@ -194,19 +372,31 @@ def main():
     tk.Label(centerFrame, textvariable=connectionStatus, **DEFAULT_LABEL).place(relx=0.5, y=750, anchor=tk.CENTER)
     # End region
 
+    # Region live telemetry chart
+    stripChart = StripChart(centerFrame, 1200, 220, frameRate=float(settings["readoutFrameRate"]))
+    stripChart.getCanvas().place(relx=0.5, y=900, anchor=tk.CENTER)
+    # End region
+
     # Region start and abort experiment buttons
     startExp = makeTextWidget("Button", centerFrame, "Begin test", command=startNewExp)
     startExp.place(relx=0.5, y=450, anchor=tk.CENTER)
     abortExpBtn = makeTextWidget("Button", centerFrame, "Abort test", command=abortExp)
+    makeTextWidget("Button", centerFrame, "Metrics", command=showMetrics).place(relx=0.8, y=450, anchor=tk.CENTER)
     # End region
 
     centerFrame.place(relx=0.5, rely=0.5, anchor=tk.CENTER)
 
-    newPowerSupply(machineAddr.get())
+    # Connecting waits until the window has been drawn, so that loading VISA never delays its first paint
+    window.after_idle(lambda: newPowerSupply(machineAddr.get()))
+    if acquisition is not None:
+        pumpAcquisition()
 
     window.mainloop()
     saveSettings()
+    if acquisition is not None:
+        acquisition.shutdown()
 
 
 if __name__=="__main__":
+    multiprocessing.freeze_support()  # In the frozen exe, makes the acquisition process serve instead of opening a window
     main()
@@ -0,0 +1,107 @@
+import json
+import time
+from bisect import bisect_left
+
+# Bucket upper bounds in seconds, ten per decade from 10 us to 10 s
+LATENCY_BOUNDS = [10 ** (exponent / 10) for exponent in range(-50, 11)]
+# Signed bounds for timing errors, where negative values are early
+LATENESS_BOUNDS = [-bound for bound in reversed(LATENCY_BOUNDS)] + [0.0] + LATENCY_BOUNDS
+PERCENTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+    # Fixed buckets, so recording is a bisect and an increment; each histogram must only be recorded from one thread
+    def __init__(self, bounds: list = LATENCY_BOUNDS):
+        self._bounds = bounds
+        self._counts = [0] * (len(bounds) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._min = float("inf")
+        self._max = float("-inf")
+
+    def record(self, value: float):
+        self._counts[bisect_left(self._bounds, value)] += 1
+        self._count += 1
+        self._sum += value
+        if value < self._min:
+            self._min = value
+        if value > self._max:
+            self._max = value
+
+    def getCount(self) -> int:
+        return self._count
+
+    def percentile(self, fraction: float) -> float:
+        # Upper bound of the bucket holding the percentile, limited to the values actually seen
+        if self._count==0:
+            return 0.0
+        counts = list(self._counts)
+        rank = fraction * sum(counts)
+        seen = 0
+        for bucket, count in enumerate(counts):
+            seen += count
+            if seen >= rank and count > 0:
+                bound = self._bounds[bucket] if bucket < len(self._bounds) else self._max
+                return min(max(bound, self._min), self._max)
+        return self._max
+
+    def snapshot(self) -> dict:
+        if self._count==0:
+            return {"count": 0}
+        snapshot = {"count": self._count, "mean": self._sum / self._count, "min": self._min, "max": self._max}
+        for fraction in PERCENTILES:
+            snapshot[f"p{round(fraction * 100)}"] = self.percentile(fraction)
+        return snapshot
+
+
+class Metrics:
+    # Named counters, values and histograms; a reader takes snapshots while the writers keep recording without locks
+    def __init__(self):
+        self._created = time.monotonic()
+        self._counters = {}
+        self._values = {}
+        self._histograms = {}
+
+    def count(self, name: str, amount: int = 1):
+        self._counters[name] = self._counters.get(name, 0) + amount
+
+    def getCount(self, name: str) -> int:
+        return self._counters.get(name, 0)
+
+    def setValue(self, name: str, value: float):
+        self._values[name] = value
+
+    def getValue(self, name: str, default: float = None) -> float:
+        return self._values.get(name, default)
+
+    def histogram(self, name: str, bounds: list = LATENCY_BOUNDS) -> Histogram:
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._histograms.setdefault(name, Histogram(bounds))
+        return histogram
+
+    def snapshot(self) -> dict:
+        return {
+            "uptime": time.monotonic() - self._created,
+            "counters": dict(self._counters),
+            "values": dict(self._values),
+            "histograms": {name: histogram.snapshot() for name, histogram in list(self._histograms.items())}
+        }
+
+
+def formatSnapshot(snapshot: dict) -> str:
+    # Times in milliseconds, one line per histogram
+    lines = [f"{name}: {value}" for name, value in sorted(snapshot["counters"].items())]
+    lines += [f"{name}: {value:.4g}" for name, value in sorted(snapshot["values"].items())]
+    for name, histogram in sorted(snapshot["histograms"].items()):
+        if histogram["count"]==0:
+            continue
+        percentiles = "  ".join(f"{key} {histogram[key] * 1000:8.3f}" for key in ("p50", "p90", "p99"))
+        lines.append(f"{name:<32} n={histogram['count']:<8} mean {histogram['mean'] * 1000:8.3f}  {percentiles}  "
+            f"max {histogram['max'] * 1000:8.3f} ms")
+    return "\n".join(lines)
+
+
+def dumpMetrics(path: str, snapshots: dict):
+    with open(path, "w") as file:
+        json.dump(snapshots, file, indent=4)
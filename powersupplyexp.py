@@ -1,19 +1,26 @@
-import csv
+import asyncio
 import os
 import threading
-import time
+from concurrent.futures import CancelledError, Future
 from datetime import datetime
 from threading import Thread
-from tkinter import messagebox
-from tkinter.filedialog import askdirectory
 
-import pyvisa
-
-from tkutils import *
+from analysis import LIMIT_MARGIN, analyzeFile
+from asyncpowersupply import (DEFAULT_FAST_POLL_PERIOD, DEFAULT_FAST_POLL_WINDOW, DEFAULT_POLL_PERIOD, AsyncPowerSupply,
+    Measurement, Setpoint, getEventLoop)
+from clock import REAL_CLOCK, Clock
+from datawriter import DEFAULT_FLUSH_INTERVAL, FORMATS, PARTIAL_SUFFIX, DataWriter, claimFileName
+from listmode import DEFAULT_LIST_LENGTH, ListModeError, ListModeRunner
+from metrics import LATENESS_BOUNDS, Metrics, dumpMetrics
+from samplebuffer import COLUMNS, DEFAULT_CAPACITY, SampleBuffer
+from scheduler import SetpointScheduler
+from setpointsource import SetpointFileError, openSetpointFile
 
 _activeExp = None
 _activePowerSupply = None
 
+UPDATE_TIMEOUT = 0.1  # Longest wait for new data before the experiment readouts are refreshed anyway
+
 
 def getActiveExp():
     return _activeExp
@@ -25,114 +32,295 @@ def killActiveExperiment():
 
 
 class Experiment(Thread):
+    # Takes plain values and callbacks so that it runs the same behind the window or from batch.py
     def __init__(self, **kwargs):
         super().__init__()
-        global _activePowerSupply
         global _activeExp
         _activeExp = self
-        self.powerSupply = _activePowerSupply
-        self.runTime = 0
-        self.filePathStringVar = kwargs["filePathStringVar"]
-        self.folderPath = kwargs["folderPathStringVar"]
-        self.runTimeStringVar = kwargs["runTimeStringVar"]
-        self.endAtZeroBoolVar = kwargs["endAtZeroBoolVar"]
-        self.voltageReadout = kwargs["voltageReadout"]
-        self.timeReadout = kwargs["timeReadout"]
-        self.progressReadout = kwargs["progressReadout"]
-        self.actualVoltageReadout = kwargs["actualVoltageReadout"]
-        self.actualCurrentReadout = kwargs["actualCurrentReadout"]
-        self.powerReadout = kwargs["powerReadout"]
-        self._onFinish = kwargs["onFinish"]
+        self.powerSupply = kwargs.get("powerSupply", _activePowerSupply)
+        self.setpointPath = kwargs.get("setpointPath")
+        self.setpoints = kwargs.get("setpoints")  # A SetpointSource, such as a WaveformSource, used instead of the file
+        self.dataFolder = kwargs["dataFolder"]
+        self.runTime = float(kwargs.get("runTime", 0))
+        self.endAtZero = kwargs.get("endAtZero", True)
+        self.interpolate = kwargs.get("interpolate", False)
+        self.listMode = kwargs.get("listMode", False)
+        self.listLength = kwargs.get("listLength", DEFAULT_LIST_LENGTH)
+        self.dataFormat = kwargs.get("dataFormat", "csv")  # A key of datawriter.FORMATS
+        self.flushInterval = float(kwargs.get("flushInterval", DEFAULT_FLUSH_INTERVAL))  # Seconds between writes to disk
+        self.maxVoltage = kwargs.get("maxVoltage")  # Top of the supply's range; setpoints above it are clamped to it
+        self._onSetpoint = kwargs.get("onSetpoint", lambda voltage: None)
+        self._onProgress = kwargs.get("onProgress", lambda elapsedTime, runTime: None)
+        self._onMeasurement = kwargs.get("onMeasurement", lambda measurement: None)
+        self._onSamples = kwargs.get("onSamples", lambda samples: None)  # Given the SampleBuffer the run records into
+        self._sampleMemory = kwargs.get("sampleMemory")  # Memory for the SampleBuffer, e.g. shared with another process
+        self._sampleCapacity = kwargs.get("sampleCapacity", DEFAULT_CAPACITY)
+        # A VirtualClock, together with a DryRunSupply on it, runs the whole profile at computation speed
+        self._clock = kwargs.get("clock", REAL_CLOCK)
+        self._onStart = kwargs.get("onStart", lambda: None)
+        self._onComplete = kwargs.get("onComplete", lambda finished: None)  # finished is False if the profile was cut short
+        self._onError = kwargs.get("onError", lambda title, message: None)
+        self._onFinish = kwargs.get("onFinish", lambda: None)
+        self._onPause = kwargs.get("onPause", lambda: None)  # The schedule is held while the instrument reconnects
+        self._onResume = kwargs.get("onResume", lambda: None)
         self.startTimestamp = 0
+        self._startTime = None
+        self._startAt = None
+        self._channel = kwargs.get("channel")
+        self._name = kwargs.get("name")
         self.elapsedTime = 0
         self._active = False
         self.daemon = True
-        self.data = []
-        self.setpoints = []
+        self.finished = False
+        self.scheduler = None
+        self.samples = None
+        self.metrics = Metrics()
+        self._fileName = None
+        self._dataWriter = None
+        self._timingWriter = None
+        self._writeError = None
+        self._daemonThread = None
 
     def _daemon(self):
-        global _activeExp
+        measurement = self.powerSupply.getMeasurement()
+        setpoint = self.powerSupply.getSetpoint()
         while self._active:
-            if self is not _activeExp:
-                self.kill()
-                break
-            self.elapsedTime = round(time.time() - self.startTimestamp, 2)
-            self.timeReadout.update("{:.2f}".format(min(self.elapsedTime, self.runTime)))
-            self.progressReadout.update("{:.2f}".format(min(100 * self.elapsedTime / self.runTime, 99)) + "%")
-            self.actualVoltageReadout.update("{:.3f}".format(self.powerSupply.getVoltage()))
-            self.actualCurrentReadout.update("{:.3f}".format(self.powerSupply.getCurrent()))
-            self.powerReadout.update("{:.3f}".format(self.powerSupply.getPower()))
-            self.data.append([self.elapsedTime, self.powerSupply.getTargetVoltage(), self.powerSupply.getVoltage(), self.powerSupply.getCurrent(), self.powerSupply.getPower()])
-            time.sleep(0.01)  # To free up CPU time
-
-    def _readCSV(self, path: str):
-        data = []
-        with open(path, newline="") as csvfile:
-            reader = csv.reader(csvfile, delimiter=",", quotechar="|")
-            for row in reader:
-                columns = []
-                for item in row:
-                    try:
-                        columns.append(float(item))
-                    except ValueError:
-                        columns.append(-1)
-                data.append(columns)
-        self.setpoints = data
-
-    def _saveExperimentData(self):
+            lastMeasurement, lastSetpoint = measurement, setpoint
+            measurement, setpoint = self.powerSupply.waitForUpdate(lastMeasurement.sequence, lastSetpoint.sequence,
+                UPDATE_TIMEOUT)
+            self._recordUpdate(lastMeasurement, lastSetpoint, measurement, setpoint)
+
+    def _recordUpdate(self, lastMeasurement: Measurement, lastSetpoint: Setpoint, measurement: Measurement,
+            setpoint: Setpoint):
+        # Only new measurements and setpoint changes are recorded, so no row is a stale copy of the previous one
+        self.elapsedTime = round(max(self._clock.monotonic() - self.startTimestamp, 0), 2)
+        self._onProgress(self.elapsedTime, self.runTime)
+        timestamps = []
+        if measurement.sequence!=lastMeasurement.sequence:
+            self.metrics.histogram("recordDelay").record(self._clock.monotonic() - measurement.timestamp)
+            currentLimit = self.powerSupply.getCurrentLimit()
+            if currentLimit is not None and measurement.current >= currentLimit * (1 - LIMIT_MARGIN):
+                self.metrics.count("currentLimitedSamples")  # The output is below its setpoint, held by the limit
+            self._onMeasurement(measurement)
+            timestamps.append(measurement.timestamp)
+        if setpoint.sequence!=lastSetpoint.sequence:
+            timestamps.append(setpoint.timestamp)
+        for timestamp in sorted(timestamps):
+            self._record(timestamp, setpoint, measurement)
+
+    def _record(self, timestamp: float, setpoint: Setpoint, measurement: Measurement):
+        if timestamp >= self.startTimestamp:
+            self.samples.append(timestamp - self.startTimestamp, setpoint.voltage, measurement.voltage,
+                measurement.current, measurement.power)
+
+    def _openSetpoints(self) -> bool:
+        # Checks the file and counts its points; rows are parsed again while the profile runs
+        if self.setpoints is not None:
+            return True
+        try:
+            self.setpoints = openSetpointFile(self.setpointPath)
+            return True
+        except (SetpointFileError, OSError) as error:
+            self._onError("Invalid setpoint file", str(error))
+            return False
+
+    def _openDataFiles(self) -> bool:
+        if self.dataFormat not in FORMATS:  # From settings.json, which nothing else checks
+            self._onError("Invalid data format", f"\"{self.dataFormat}\" is not a known data format. "
+                f"Use one of: {', '.join(FORMATS)}.")
+            return False
         now = datetime.now()
-        folderPath = self.folderPath.get()
-        if not os.path.exists(folderPath):
-            folderPath = askdirectory(title="Data storage directory")
-            self.folderPath.set(folderPath)
+        fileName = f"{self.dataFolder}/experiment-{now.year}-{now.month}-{now.day}_{now.hour}-{now.minute}-{now.second}"
+        if self._channel is not None:
+            fileName += f"-{self._channel}"  # Experiments running side by side on other channels write their own files
+        if self._name is not None:
+            fileName += f"-{self._name}"
         try:
-            with open(f"{folderPath}/experiment-{now.year}-{now.month}-{now.day}_{now.hour}-{now.minute}.csv", "w",
-                    newline="") as file:
-                writer = csv.writer(file, delimiter=",")
-                writer.writerow(["Elapsed Time", "Target Voltage", "Actual Voltage", "Current", "Power"])
-                for row in self.data:
-                    writer.writerow(row)
+            extension = FORMATS[self.dataFormat].extension
+            fileName = claimFileName(fileName, [extension, f"-timing{extension}"])
+            self._fileName = fileName
+            self._dataWriter = DataWriter(f"{fileName}{extension}", list(COLUMNS), self.flushInterval, self.dataFormat,
+                onError=self._onWriteError)
+            self._timingWriter = DataWriter(f"{fileName}-timing{extension}",
+                ["Step", "Target Voltage", "Planned Time", "Achieved Time", "Timing Error"], self.flushInterval,
+                self.dataFormat, onError=self._onWriteError)
+            # Spilled as often as the writer flushes, so that samples do not wait in memory longer than its interval
+            self.samples = SampleBuffer(self._sampleCapacity, spill=self._dataWriter.writeRows, memory=self._sampleMemory,
+                spillInterval=self.flushInterval)
+            self._onSamples(self.samples)
+            return True
         except (FileNotFoundError, PermissionError):
-            def retry():
-                if messagebox.askretrycancel("Invalid path", icon=messagebox.ERROR,
-                        message="The experiment data could not be saved because an invalid path was specified."):
-                    self._saveExperimentData()
+            if self._dataWriter is not None:
+                self._dataWriter.finish()
+            self._onError("Invalid path", "The experiment could not be started because the data storage path is invalid.")
+            return False
+        except ValueError as error:  # The data format cannot be written here
+            if self._dataWriter is not None:
+                self._dataWriter.finish()
+            else:
+                os.remove(f"{fileName}{extension}{PARTIAL_SUFFIX}")  # Release the name claimFileName reserved
+            self._onError("Invalid data format", str(error))
+            return False
+
+    def _onWriteError(self, error: Exception):
+        # Called from a DataWriter's thread; nothing more can be recorded, so the run is stopped
+        if self._writeError is not None:
+            return  # A full disk fails both files, but one message is enough
+        self._writeError = error
+        self._onError("Data could not be saved", f"{type(error).__name__}: {error}\n"
+            f"The data written so far is in {self._fileName}*{PARTIAL_SUFFIX}.")
+        self.kill()
+
+    def _metadata(self) -> dict:
+        idn = self.powerSupply.getIDN()
+        return {
+            "instrument": idn.strip() if idn is not None else None,
+            "setpointSource": self.setpoints.origin if self.setpoints.origin is not None else type(self.setpoints).__name__,
+            "runTime": self.runTime if self.scheduler is None else self.scheduler.getRunTime(),
+            "currentLimit": self.powerSupply.getCurrentLimit(),
+            "startTime": self._startTime,
+            "interpolate": self.interpolate,
+            "listMode": self.listMode,
+            "endAtZero": self.endAtZero,
+            "maxVoltage": self.maxVoltage,
+            "channel": self._channel,
+            "finished": self.finished,
+            "meanSampleRate": self.samples.getCount() / self.elapsedTime if self.elapsedTime > 0 else None,
+            "pausedTime": self.scheduler.getPausedTime() if self.scheduler is not None else 0.0,
+            "dryRun": self._clock.isVirtual()
+        }
+
+    def _closeDataFiles(self):
+        self.samples.flush()
+        metadata = self._metadata()
+        self._dataWriter.setMetadata(metadata)
+        self._timingWriter.setMetadata(metadata)
+        self._dataWriter.finish()
+        self._timingWriter.finish()
+        try:
+            dumpMetrics(f"{self._fileName}-metrics.json", self.getMetricsSnapshot())
+        except OSError:
+            pass  # The data itself is already saved
+        if self._dataWriter.error is None:
+            # Not a daemon thread like this one, so that a batch or the window only exits once the summary is written
+            threading.Thread(target=self._analyze, daemon=False).start()
+
+    def _analyze(self):
+        try:
+            analyzeFile(self._dataWriter.path, self.powerSupply.getCurrentLimit())
+        except ImportError:
+            pass  # The analysis needs NumPy
+        except (OSError, ValueError) as error:
+            self._onError("Analysis failed", str(error))
+
+    def getMetricsSnapshot(self) -> dict:
+        return {"experiment": self.metrics.snapshot(), "instrument": self.powerSupply.getMetrics().snapshot()}
+
+    def _recordStep(self, step):
+        self.metrics.histogram("schedulerLateness", LATENESS_BOUNDS).record(step.error)
+        self._timingWriter.write(step)
+
+    def _clamp(self, voltage: float) -> float:
+        if voltage < 0:
+            self.metrics.count("clampedSetpoints")  # The supply cannot source negative voltages
+            return 0.0
+        if self.maxVoltage is not None and voltage > self.maxVoltage:
+            self.metrics.count("overRangeSetpoints")
+            return float(self.maxVoltage)
+        return voltage
+
+    def _applySetpoint(self, voltage: float) -> bool:
+        # Returns False if the voltage did not reach the instrument, so that the scheduler pauses and retries it
+        targetVoltage = self._clamp(voltage)
+        try:
+            # Wait for the write so the scheduler sees its real latency
+            if self.powerSupply.setVoltage(targetVoltage).result() is False:
+                return False
+        except CancelledError:  # The power supply was shut down
+            pass
+        self._onSetpoint(targetVoltage)
+        return True
+
+    def _pause(self):
+        self.metrics.count("pauses")
+        self._onPause()
+
+    def _resume(self, pausedTime: float):
+        self.metrics.histogram("pause").record(pausedTime)
+        self._onResume()
+
+    def _runFromListMemory(self) -> bool:
+        steps = ((self._clamp(voltage), duration) for voltage, duration in self.scheduler.plannedSteps())
+        runner = ListModeRunner(self.powerSupply, steps, isActive=lambda: self._active,
+            onStep=self._onListStep, listLength=self.listLength, clock=self._clock)
+        try:
+            return runner.run(self.startTimestamp)
+        except CancelledError:  # The power supply was shut down
+            return False
+        except ListModeError as error:  # Treated like a lost connection: the run stops and its files are finalized
+            self._onError("List mode failed", str(error))
+            return False
 
-            self.filePathStringVar.after(0, func=retry)
+    def _onListStep(self, step):
+        self.scheduler.recordStep(step)  # So that the scheduler's timing summary covers list memory runs too
+        self._onSetpoint(step.voltage)
 
     def run(self):
-        finished = False
         self._active = True
-        self.progressReadout.recolor(BLUE)
-        self._readCSV(self.filePathStringVar.get())
-        self.runTime = float(self.runTimeStringVar.get())
-        endAtZero = self.endAtZeroBoolVar.get()
-        self.startTimestamp = time.time()
-        threading.Thread(target=self._daemon, daemon=True).start()
-        timePerPoint = self.runTime / len(self.setpoints)
-        for i in range(len(self.setpoints)):
-            targetVoltage = max(self.setpoints[i][0], 0.0)
-            self.powerSupply.setVoltage(targetVoltage)
-            self.voltageReadout.update(targetVoltage)
-            time.sleep(timePerPoint)
-            if i==len(self.setpoints) - 1:
-                finished = True
-            if not self._active:
-                break
-        if endAtZero:
-            self.powerSupply.setVoltage(0)
-            self.voltageReadout.update(0)
-        if self._active:
-            self.progressReadout.recolor(FINISHED_GREEN)
+        if not self._openSetpoints() or not self._openDataFiles():
             self._active = False
-            time.sleep(0.1)
             self._onFinish()
-            if finished:
-                self.progressReadout.update("100.00%")
-            self._saveExperimentData()
+            return
+        self.scheduler = SetpointScheduler(self.setpoints, self.runTime, self._applySetpoint,
+            interpolate=self.interpolate, isActive=lambda: self._active, onStep=self._recordStep, clock=self._clock,
+            isReady=self.powerSupply.isConnected, onPause=self._pause, onResume=self._resume)
+        self.runTime = self.scheduler.getRunTime()  # Per-point durations in the setpoint file override the run time
+        self._onStart()
+        self.startTimestamp = self._clock.monotonic() if self._startAt is None else self._startAt
+        self._startTime = datetime.now().isoformat()
+        if self._clock.isVirtual():  # Virtual time only passes in this thread, so record the updates as they are made
+            self.powerSupply.onUpdate(self._recordUpdate)
+        else:
+            self._daemonThread = threading.Thread(target=self._daemon, daemon=True)
+            self._daemonThread.start()
+        self.powerSupply.setOutputHeld(True)
+        try:
+            if self.listMode:
+                finished = self._runFromListMemory()
+            else:
+                finished = self.scheduler.run(self.startTimestamp)
+        except SetpointFileError as error:  # A malformed row further into the file
+            finished = False
+            self._onError("Invalid setpoint file", str(error))
+        if self.endAtZero:
+            self._applySetpoint(0)
+        self.powerSupply.setOutputHeld(False)
+        completed = self._active or self._writeError is not None  # Only a kill() from outside goes unreported
+        self._active = False
+        if self._daemonThread is not None:
+            self._daemonThread.join()
+        else:
+            self.powerSupply.onUpdate(None)
+        self.finished = finished
+        self._closeDataFiles()  # Aborted runs are finalized too so that the data recorded so far is kept
+        if completed:
+            self._onComplete(finished)
+            self._onFinish()
+
+    def scheduleStart(self, startTimestamp: float):
+        # Makes run() apply its first setpoint at this timestamp of the experiment's clock, for starts synchronized across channels
+        self._startAt = startTimestamp
+
+    def setChannel(self, channel: str):
+        self._channel = channel
+
+    def getClock(self) -> Clock:
+        return self._clock
 
     def kill(self):
         self._active = False
+        if self.powerSupply is not None:
+            self.powerSupply.setOutputHeld(False)  # A reconnect before run() notices must not restore the voltage either
 
 
 def getActivePowerSupply():
@@ -140,126 +328,116 @@ def getActivePowerSupply():
 
 
 class PowerSupply:
-    def __init__(self, resourceName: str, autoConnect: bool = False, onConnect=lambda: None, onDisconnect=lambda: None):
+    # Threaded API over AsyncPowerSupply; its polling runs on the shared background event loop
+    def __init__(self, resourceName: str, autoConnect: bool = False, onConnect=lambda: None, onDisconnect=lambda: None,
+            pollPeriod: float = DEFAULT_POLL_PERIOD, batchedMeasurement: bool = True, resourceManager=None,
+            loop: asyncio.AbstractEventLoop = None, fastPollWindow: float = DEFAULT_FAST_POLL_WINDOW,
+            fastPollPeriod: float = DEFAULT_FAST_POLL_PERIOD, onError=lambda title, message: None):
         global _activePowerSupply
-        _activePowerSupply = self
-        self._instr = None
-        self._resourceName = resourceName
-        self._rm = pyvisa.ResourceManager()
-        self._onConnect = onConnect
-        self._onDisconnect = onDisconnect
-        self._lastConnected = False
-        self._active = False
-        self._currentLimit = None
-        self._IDN = None
-        self._targetVoltage = 0
-        self._targetCurrent = 0
-        self._voltage = 0
-        self._current = 0
+        _activePowerSupply = self  # The newest supply is the default for experiments that are not given one
+        self._async = AsyncPowerSupply(resourceName, onConnect=onConnect, onDisconnect=onDisconnect,
+            pollPeriod=pollPeriod, batchedMeasurement=batchedMeasurement, resourceManager=resourceManager,
+            fastPollWindow=fastPollWindow, fastPollPeriod=fastPollPeriod, onError=onError)
+        self._loop = getEventLoop() if loop is None else loop
         if autoConnect:
             self.tryConnect()
 
+    def getAsync(self) -> AsyncPowerSupply:
+        return self._async
+
+    def getClock(self) -> Clock:
+        return REAL_CLOCK
+
+    def _run(self, coroutine) -> Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
     def onConnect(self, onConnect):
-        self._onConnect = onConnect
+        self._async.onConnect(onConnect)
 
     def onDisconnect(self, onDisconnect):
-        self._onDisconnect = onDisconnect
+        self._async.onDisconnect(onDisconnect)
+
+    def onError(self, onError):
+        self._async.onError(onError)
 
     def tryConnect(self):
-        if not self._active:
-            self._active = True
-            threading.Thread(target=self._daemon, daemon=True).start()
+        self._async.start(self._loop)
         return self
 
     def kill(self):
-        if self.isConnected():
-            self._instr.write("INP:STOP\n")  # Disable DC input
-        self._active = False
+        self._async.stop()
 
-    def _checkForDisconnect(self):
-        try:
-            self._instr.session
-        except pyvisa.errors.InvalidSession:
-            self._instr = None
-        except AttributeError:  # If the _instr field is already None
-            pass
+    def getIDN(self):
+        return self._async.getIDN()
 
-    def _connect(self):
-        try:
-            self._instr = self._rm.open_resource(self._resourceName)
-            self._IDN = self._instr.query("*IDN?")
-            self._instr.write("CURR 0\n")  # Set the current to zero before enabling DC input
-            self._instr.write("INP:START\n")  # Enable DC input
-            self._onConnect()
-        except pyvisa.errors.VisaIOError:
-            pass
+    def getMetrics(self) -> Metrics:
+        return self._async.getMetrics()
 
-    def _refresh(self):
-        try:
-            self._voltage = float(self.query("MEASure:VOLTage?\n"))
-            self._current = float(self.query("MEASure:CURRent?\n"))
-        except ValueError:
-            pass
+    def getPollingRate(self) -> float:
+        return self._async.getPollingRate()
 
-    def _daemon(self):
-        global _activePowerSupply
-        while self._active:
-            if not self is _activePowerSupply:
-                self.kill()
-                break
-            self._checkForDisconnect()
-            if self.isConnected():
-                self._refresh()
-            else:
-                self._connect()
-            if self._lastConnected and not self.isConnected():
-                self._onDisconnect()
-            self._lastConnected = self.isConnected()
-            time.sleep(0.1)  # Sleep to save CPU time
+    def setPollPeriod(self, pollPeriod: float):
+        self._async.setPollPeriod(pollPeriod)
 
-    def getIDN(self):
-        return self._IDN
+    def getPollPeriod(self):
+        return self._async.getPollPeriod()
+
+    def setAdaptivePolling(self, fastPollWindow: float, fastPollPeriod: float = DEFAULT_FAST_POLL_PERIOD):
+        self._async.setAdaptivePolling(fastPollWindow, fastPollPeriod)
+
+    def applyCurrentLimit(self, limit) -> Future:
+        return self._run(self._async.applyCurrentLimit(limit))
+
+    def setVoltage(self, voltage: float) -> Future:
+        return self._run(self._async.setVoltage(voltage))
+
+    def setCurrent(self, current: float) -> Future:
+        return self._run(self._async.setCurrent(current))
 
-    def applyCurrentLimit(self, limit):
-        if self.isConnected():
-            self._currentLimit = limit
-            self._instr.write(f"SOUR: CURR {limit}\n")
+    def setOutputHeld(self, held: bool) -> Future:
+        return self._run(self._async.setOutputHeld(held))
 
-    def setVoltage(self, voltage: float):
-        if self.isConnected():
-            self._targetVoltage = voltage
-            self._instr.write(f"VOLT {voltage}\n")
+    def measure(self) -> Measurement:
+        return self._run(self._async.measure()).result()
 
-    def setCurrent(self, current: float):
-        if self.isConnected():
-            self._targetCurrent = current
-            self._instr.write(f"CURR {current}\n")
+    def getMeasurement(self) -> Measurement:
+        return self._async.getMeasurement()
+
+    def getSetpoint(self) -> Setpoint:
+        return self._async.getSetpoint()
+
+    def publishTargetVoltage(self, voltage: float):
+        self._async.publishTargetVoltage(voltage)
+
+    def waitForUpdate(self, measurementSequence: int, setpointSequence: int, timeout: float = None) -> (Measurement, Setpoint):
+        return self._async.waitForUpdate(measurementSequence, setpointSequence, timeout)
+
+    def getCurrentLimit(self):
+        return self._async.getCurrentLimit()
 
     def getVoltage(self):
-        return self._voltage
+        return self._async.getVoltage()
 
     def getCurrent(self):
-        return self._current
+        return self._async.getCurrent()
 
     def getTargetVoltage(self):
-        return self._targetVoltage
+        return self._async.getTargetVoltage()
 
     def getTargetCurrent(self):
-        return self._targetCurrent
+        return self._async.getTargetCurrent()
 
     def getPower(self):
-        if self.isConnected():
-            return self.getCurrent() * self.getVoltage()
-        else:
-            return 0
+        return self._async.getPower()
+
+    def writeCommand(self, command: str) -> Future:
+        return self._run(self._async.writeCommand(command))
 
-    def writeCommand(self, command: str):
-        if self.isConnected():
-            self._instr.write(command)
+    def requestQuery(self, query: str) -> Future:
+        return self._run(self._async.query(query))
 
     def query(self, query: str):
-        if self.isConnected():
-            return self._instr.query(query)
+        return self.requestQuery(query).result()
 
     def isConnected(self):
-        return self._instr is not None
+        return self._async.isConnected()
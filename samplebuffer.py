@@ -0,0 +1,101 @@
+import threading
+import time
+
+COLUMNS = ("Elapsed Time", "Target Voltage", "Actual Voltage", "Current", "Power")
+DEFAULT_CAPACITY = 65536  # Samples kept in memory
+DEFAULT_SPILL_SIZE = 256  # Samples collected before they are handed to the spill callback
+DEFAULT_SPILL_INTERVAL = 1.0  # Seconds after which samples are handed over even if fewer than the spill size arrived
+_HEADER_BYTES = 8  # The sample count, stored in front of the columns so that readers in other processes see it
+
+
+def bufferSize(capacity: int) -> int:
+    # Bytes of memory a SampleBuffer of this capacity needs, e.g. for a multiprocessing.shared_memory block
+    return _HEADER_BYTES + len(COLUMNS) * 2 * capacity * 8
+
+
+class SampleBuffer:
+    # Each column holds every sample twice, at i and i + capacity, so the newest n samples are always contiguous
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, spill=None, spillSize: int = DEFAULT_SPILL_SIZE, memory=None,
+            spillInterval: float = DEFAULT_SPILL_INTERVAL):
+        # memory is an optional writable buffer of bufferSize(capacity) bytes, such as SharedMemory.buf, to write into
+        self._map(capacity, bytearray(bufferSize(capacity)) if memory is None else memory)
+        self._countView[0] = 0
+        self._spilled = 0  # Samples already handed to the spill callback
+        self._spill = spill
+        self._spillSize = min(spillSize, capacity)
+        self._spillInterval = spillInterval  # Real time, since it bounds what a crash can lose
+        self._lastSpill = time.monotonic()
+
+    @staticmethod
+    def attach(memory, capacity: int = DEFAULT_CAPACITY):
+        # A reader of samples another process writes into memory; it must not append
+        buffer = SampleBuffer.__new__(SampleBuffer)
+        buffer._map(capacity, memory)
+        buffer._spilled = 0
+        buffer._spill = None
+        buffer._spillSize = 0
+        buffer._spillInterval = None
+        buffer._lastSpill = None
+        return buffer
+
+    def _map(self, capacity: int, memory):
+        self._capacity = capacity
+        self._memory = memoryview(memory)
+        self._countView = self._memory[:_HEADER_BYTES].cast("q")  # Samples appended since the buffer was created
+        columnBytes = 2 * capacity * 8
+        self._views = [self._memory[_HEADER_BYTES + i * columnBytes:_HEADER_BYTES + (i + 1) * columnBytes].cast("d")
+            for i in range(len(COLUMNS))]
+        self._lock = threading.RLock()
+
+    @property
+    def _count(self):
+        return self._countView[0]
+
+    def close(self):
+        # Releases the views, which shared memory requires before it can be closed
+        for view in self._views:
+            view.release()
+        self._countView.release()
+        self._memory.release()
+
+    def __len__(self):
+        return min(self._count, self._capacity)
+
+    def getCapacity(self):
+        return self._capacity
+
+    def getCount(self):
+        return self._count
+
+    def append(self, *values: float):
+        with self._lock:
+            head = self._count % self._capacity
+            for column, value in zip(self._views, values):
+                column[head] = value
+                column[head + self._capacity] = value
+            self._countView[0] += 1  # Only after the values, so that a reader never sees a half-written sample
+            if self._spill is not None and (self._count - self._spilled >= self._spillSize
+                    or time.monotonic() - self._lastSpill >= self._spillInterval):
+                self._spillPending()
+
+    def latest(self, n: int = None) -> tuple:
+        # Views share memory with the buffer, so they keep changing as new samples arrive
+        with self._lock:
+            count = self._count
+            n = min(count, self._capacity) if n is None else max(min(n, count, self._capacity), 0)
+            end = count % self._capacity + self._capacity
+            return tuple(view[end - n:end] for view in self._views)
+
+    def latestColumn(self, column: int, n: int = None) -> memoryview:
+        return self.latest(n)[column]
+
+    def _spillPending(self):
+        pending = min(self._count - self._spilled, self._capacity)
+        self._spill(list(zip(*self.latest(pending))))
+        self._spilled = self._count
+        self._lastSpill = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            if self._spill is not None and self._count > self._spilled:
+                self._spillPending()
@@ -0,0 +1,202 @@
+import inspect
+from collections import namedtuple
+
+from clock import REAL_CLOCK, Clock
+
+StepTiming = namedtuple("StepTiming", ["index", "voltage", "plannedTime", "achievedTime", "error"])
+
+DEFAULT_STEP_PERIOD = 0.05  # Seconds between interpolated setpoints
+LATENCY_SMOOTHING = 0.2  # Weight given to the newest write latency in the running average
+MAX_SLEEP = 0.1  # Longest uninterrupted sleep so that aborts are noticed quickly
+STALL_THRESHOLD = 0.25  # Seconds a write may take and still count towards the average latency
+
+
+class SetpointScheduler:
+    # setpoints is a SetpointSource; its rows are read one at a time while the profile runs
+    # apply may return False if the voltage did not reach the instrument; the schedule then pauses until isReady()
+    # and retries it, and every later step is shifted by the length of the pause. Only pauses shift the plan; a write
+    # that is merely slow is caught up on, and its lateness shows in the step timing.
+    def __init__(self, setpoints, runTime: float, apply, interpolate: bool = False,
+            stepPeriod: float = DEFAULT_STEP_PERIOD, isActive=lambda: True, onStep=None, clock: Clock = REAL_CLOCK,
+            isReady=lambda: True, onPause=lambda: None, onResume=lambda pausedTime: None):
+        self._setpoints = setpoints
+        self._clock = clock
+        self._timePerPoint = runTime / len(setpoints) if len(setpoints) > 0 else 0.0
+        # Per-point durations override the run time; a streamed file only knows their total once it has been read
+        self._runTime = setpoints.getTotalDuration() if setpoints.hasDurations() else runTime
+        self._estimatedRunTime = runTime
+        self._apply = apply
+        self._interpolate = interpolate
+        self._stepPeriod = stepPeriod
+        self._isActive = isActive
+        self._isReady = isReady
+        self._onPause = onPause
+        self._onResume = onResume
+        self._pausedTime = 0.0  # Total length of the pauses so far
+        self._latency = 0.0
+        self._stepCount = 0
+        self._errorSum = 0.0
+        self._maxError = 0.0
+        self.timing = []
+        self._onStep = self.timing.append if onStep is None else onStep  # Pass onStep to stream timings instead of keeping them
+
+    def getRunTime(self):
+        # Falls back to the requested run time while the total of a streamed duration column is still unknown
+        return self._estimatedRunTime if self._runTime is None else self._runTime
+
+    def getLatency(self):
+        return self._latency
+
+    def getPausedTime(self):
+        return self._pausedTime
+
+    def _points(self):
+        # (voltage, duration) pairs straight from the source
+        for voltage, duration in self._setpoints:
+            yield voltage, self._timePerPoint if duration is None else max(duration, 0.0)
+
+    def _steps(self):
+        offset = 0.0
+        for i, (voltage, duration) in enumerate(self._points()):
+            yield i, offset, voltage
+            offset += duration
+        self._runTime = offset
+
+    def _interpolatedSteps(self):
+        points = self._points()
+        point = next(points, None)
+        if point is None:
+            self._runTime = 0.0
+            return
+        nextPoint = next(points, None)  # One point of look-ahead is all interpolation needs
+        pointStart = 0.0
+        tick = 0
+        offset = 0.0
+        while True:
+            while nextPoint is not None and offset >= pointStart + point[1]:
+                pointStart += point[1]
+                point = nextPoint
+                nextPoint = next(points, None)
+            if nextPoint is None and offset >= pointStart + point[1]:
+                break
+            voltage = point[0]
+            if nextPoint is not None and point[1] > 0:
+                fraction = (offset - pointStart) / point[1]
+                voltage += fraction * (nextPoint[0] - voltage)
+            yield tick, offset, voltage
+            tick += 1
+            offset = tick * self._stepPeriod
+        self._runTime = pointStart + point[1]
+
+    def plannedSteps(self):
+        # (voltage, duration) pairs in the order run() would apply them, generated lazily
+        previous = None
+        for index, offset, voltage in self._interpolatedSteps() if self._interpolate else self._steps():
+            if previous is not None:
+                yield previous[1], offset - previous[0]
+            previous = (offset, voltage)
+        if previous is not None:
+            yield previous[1], self.getRunTime() - previous[0]
+
+    def _sleepUntil(self, deadline: float) -> bool:
+        while self._isActive():
+            remaining = deadline - self._clock.monotonic()
+            if remaining <= 0:
+                return True
+            self._clock.sleep(min(remaining, MAX_SLEEP))
+        return False
+
+    async def _sleepUntilAsync(self, deadline: float) -> bool:
+        while self._isActive():
+            remaining = deadline - self._clock.monotonic()
+            if remaining <= 0:
+                return True
+            await self._clock.sleepAsync(min(remaining, MAX_SLEEP))
+        return False
+
+    def _dueSteps(self, start: float):
+        # Yields (index, offset, voltage, deadline) for every step that should still be applied
+        for index, offset, voltage in self._interpolatedSteps() if self._interpolate else self._steps():
+            deadline = start + self._pausedTime + offset
+            if self._interpolate and self._clock.monotonic() > deadline + self._stepPeriod:
+                continue  # Drop interpolated points that are already stale instead of falling further behind
+            yield index, offset, voltage, deadline
+
+    def _resume(self, pauseStart: float):
+        pausedTime = self._clock.monotonic() - pauseStart
+        self._pausedTime += pausedTime
+        self._onResume(pausedTime)
+
+    def _pause(self, pauseStart: float) -> bool:
+        # Waits until isReady(); returns False if the run was aborted meanwhile. The pause counts from pauseStart, so that
+        # the time the failed write spent blocked is shifted out of the plan too.
+        self._onPause()
+        while self._isActive():
+            self._clock.sleep(MAX_SLEEP)
+            if self._isReady():
+                self._resume(pauseStart)
+                return True
+        return False
+
+    async def _pauseAsync(self, pauseStart: float) -> bool:
+        self._onPause()
+        while self._isActive():
+            await self._clock.sleepAsync(MAX_SLEEP)
+            if self._isReady():
+                self._resume(pauseStart)
+                return True
+        return False
+
+    def run(self, startTime: float = None) -> bool:
+        # startTime is a timestamp of the scheduler's clock; returns True if the whole profile was applied
+        start = self._clock.monotonic() if startTime is None else startTime
+        for index, offset, voltage, deadline in self._dueSteps(start):
+            # Wake up early by the average write latency so that the write lands on the deadline
+            if not self._sleepUntil(deadline - self._latency):
+                return False
+            before = self._clock.monotonic()
+            while not self._isReady() or self._apply(voltage) is False:
+                if not self._pause(max(deadline, before)):
+                    return False
+                deadline = start + self._pausedTime + offset
+                before = self._clock.monotonic()
+            self._finishStep(index, offset, voltage, start, deadline, before)
+        return self._sleepUntil(start + self._pausedTime + self.getRunTime())
+
+    async def runAsync(self, startTime: float = None) -> bool:
+        # Coroutine version of run(); apply may return an awaitable, such as AsyncPowerSupply.setVoltage()
+        start = self._clock.monotonic() if startTime is None else startTime
+        for index, offset, voltage, deadline in self._dueSteps(start):
+            if not await self._sleepUntilAsync(deadline - self._latency):
+                return False
+            before = self._clock.monotonic()
+            while True:
+                result = self._apply(voltage) if self._isReady() else False
+                if inspect.isawaitable(result):
+                    result = await result
+                if result is not False:
+                    break
+                if not await self._pauseAsync(max(deadline, before)):
+                    return False
+                deadline = start + self._pausedTime + offset
+                before = self._clock.monotonic()
+            self._finishStep(index, offset, voltage, start, deadline, before)
+        return await self._sleepUntilAsync(start + self._pausedTime + self.getRunTime())
+
+    def _finishStep(self, index: int, offset: float, voltage: float, start: float, deadline: float, before: float):
+        achieved = self._clock.monotonic()
+        if achieved - before <= STALL_THRESHOLD:  # A write held up behind a VISA timeout would skew the average for long
+            self._latency += LATENCY_SMOOTHING * ((achieved - before) - self._latency)
+        # The planned time includes the pauses so far, so that it is the deadline the error is measured against
+        self.recordStep(StepTiming(index, voltage, deadline - start, achieved - start, achieved - deadline))
+
+    def recordStep(self, step: StepTiming):
+        # Also given the steps a ListModeRunner times when the profile runs from list memory instead
+        self._stepCount += 1
+        self._errorSum += abs(step.error)
+        self._maxError = max(self._maxError, abs(step.error))
+        self._onStep(step)
+
+    def timingSummary(self) -> dict:
+        meanError = self._errorSum / self._stepCount if self._stepCount > 0 else 0.0
+        return {"steps": self._stepCount, "meanError": meanError, "maxError": self._maxError}
@@ -0,0 +1,174 @@
+import csv
+import mmap
+import os
+import sys
+
+# Extensions of the non-CSV profile formats; anything else is read as CSV
+NPY_EXTENSION = ".npy"  # NumPy array of voltages, or of (voltage, duration) rows
+FLOAT32_EXTENSION = ".f32"  # Packed little-endian float32 voltages
+WAVEFORM_EXTENSION = ".json"  # Waveform description, see waveform.fromDescription
+
+SETPOINT_FILE_TYPES = [("Setpoint files", ".csv .npy .f32 .json"), ("CSV Files", ".csv"), ("Waveforms", ".json")]
+
+
+class SetpointFileError(ValueError):
+    pass
+
+
+class SetpointSource:
+    # Setpoints as (voltage, duration) pairs; duration is None unless the source has a time column
+    origin = None  # Where the setpoints came from, such as a file path, for the metadata of the data files
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def __iter__(self):
+        raise NotImplementedError
+
+    def hasDurations(self) -> bool:
+        return False
+
+    def getTotalDuration(self):
+        # None when it cannot be known without reading the whole source
+        return None
+
+
+class ArraySetpointSource(SetpointSource):
+    # Wraps indexable columns such as lists, memoryviews or memory-mapped NumPy arrays without copying them
+    def __init__(self, voltages, durations=None):
+        self._voltages = voltages
+        self._durations = durations
+
+    def __len__(self):
+        return len(self._voltages)
+
+    def __iter__(self):
+        for i in range(len(self._voltages)):
+            yield float(self._voltages[i]), None if self._durations is None else float(self._durations[i])
+
+    def hasDurations(self):
+        return self._durations is not None
+
+    def getTotalDuration(self):
+        if self._durations is None:
+            return None
+        return float(self._durations.sum()) if hasattr(self._durations, "sum") else float(sum(self._durations))
+
+
+def fromRows(rows: list) -> ArraySetpointSource:
+    # Rows are [voltage] or [voltage, duration] lists; durations are only used if every row has one
+    durations = [row[1] for row in rows] if len(rows) > 0 and all(len(row) > 1 for row in rows) else None
+    return ArraySetpointSource([row[0] for row in rows], durations)
+
+
+def _isNumber(item: str) -> bool:
+    try:
+        float(item)
+        return True
+    except ValueError:
+        return False
+
+
+class CSVSetpointSource(SetpointSource):
+    # Every row is checked when the file is opened, so that a bad row is reported before any setpoint is applied. The
+    # rows are parsed again while they are applied instead of being kept, so a long file takes no memory.
+    def __init__(self, path: str):
+        self._path = path
+        self._hasHeader = False
+        self._hasDurations = False
+        self._length = 0
+        self._totalDuration = None
+        with open(path, newline="") as csvfile:
+            rows = (row for row in csv.reader(csvfile, delimiter=",", quotechar="|") if len(row) > 0)
+            first = next(rows, None)
+            if first is not None and not any(_isNumber(item) for item in first):
+                self._hasHeader = True  # A first row without any numbers is a column header
+                first = next(rows, None)
+            if first is not None:
+                self._hasDurations = len(first) > 1 and _isNumber(first[1])
+        totalDuration = 0.0
+        for voltage, duration in self:
+            self._length += 1
+            if duration is not None:
+                totalDuration += duration
+        if self._hasDurations:
+            self._totalDuration = totalDuration
+
+    def __len__(self):
+        return self._length
+
+    def hasDurations(self):
+        return self._hasDurations
+
+    def getTotalDuration(self):
+        return self._totalDuration
+
+    def _parse(self, item: str, lineNumber: int, column: str) -> float:
+        try:
+            return float(item)
+        except ValueError:
+            raise SetpointFileError(f"Line {lineNumber} of {os.path.basename(self._path)}: the {column} \"{item}\" is not a number")
+
+    def __iter__(self):
+        with open(self._path, newline="") as csvfile:
+            reader = csv.reader(csvfile, delimiter=",", quotechar="|")
+            skipHeader = self._hasHeader
+            for row in reader:
+                if len(row)==0:
+                    continue
+                if skipHeader:
+                    skipHeader = False
+                    continue
+                voltage = self._parse(row[0], reader.line_num, "voltage")
+                if not self._hasDurations:
+                    yield voltage, None
+                elif len(row) < 2:
+                    raise SetpointFileError(f"Line {reader.line_num} of {os.path.basename(self._path)}: the duration is missing")
+                else:
+                    yield voltage, self._parse(row[1], reader.line_num, "duration")
+
+
+def _openNpy(path: str) -> ArraySetpointSource:
+    try:
+        import numpy
+    except ImportError:
+        raise SetpointFileError("NumPy is needed to read .npy setpoint files")
+    profile = numpy.load(path, mmap_mode="r")  # Memory mapped, so nothing is read until a point is applied
+    if profile.ndim==1:
+        return ArraySetpointSource(profile)
+    if profile.ndim==2 and profile.shape[1] >= 2:
+        return ArraySetpointSource(profile[:, 0], profile[:, 1])
+    if profile.ndim==2 and profile.shape[1]==1:
+        return ArraySetpointSource(profile[:, 0])
+    raise SetpointFileError(f"{os.path.basename(path)} must hold a list of voltages or of (voltage, duration) rows")
+
+
+def _openFloat32(path: str) -> ArraySetpointSource:
+    if os.path.getsize(path) % 4!=0:
+        raise SetpointFileError(f"{os.path.basename(path)} is not a whole number of float32 values")
+    if os.path.getsize(path)==0:
+        return ArraySetpointSource([])
+    if sys.byteorder!="little":  # A memoryview reads native byte order, which is only right on little-endian hosts
+        try:
+            import numpy
+        except ImportError:
+            raise SetpointFileError("NumPy is needed to read .f32 setpoint files on a big-endian computer")
+        return ArraySetpointSource(numpy.memmap(path, dtype="<f4", mode="r"))
+    with open(path, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)  # Stays valid after the file is closed
+    return ArraySetpointSource(memoryview(mapped).cast("f"))
+
+
+def openSetpointFile(path: str) -> SetpointSource:
+    extension = os.path.splitext(path)[1].lower()
+    if extension==NPY_EXTENSION:
+        source = _openNpy(path)
+    elif extension==FLOAT32_EXTENSION:
+        source = _openFloat32(path)
+    elif extension==WAVEFORM_EXTENSION:
+        from waveform import openWaveformFile  # waveform builds on this module
+        source = openWaveformFile(path)
+    else:
+        source = CSVSetpointSource(path)
+    source.origin = os.path.abspath(path)
+    return source
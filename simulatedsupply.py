@@ -0,0 +1,276 @@
+import math
+import random
+import re
+import threading
+
+from clock import REAL_CLOCK, Clock
+
+SIMULATED_PREFIX = "SIM::"  # Resource names starting with this open a SimulatedInstrument, e.g. SIM::latency=0.005::jitter=0.001
+DEFAULT_IDN = "Simulated,Power Supply,0,1.0"
+
+# Long forms of the SCPI mnemonics the simulator understands, mapped to their short forms
+_MNEMONICS = {
+    "MEASURE": "MEAS", "VOLTAGE": "VOLT", "CURRENT": "CURR", "POWER": "POW", "INPUT": "INP", "SOURCE": "SOUR",
+    "DWELL": "DWEL", "COUNT": "COUN", "TRIGGER": "TRIG", "INITIATE": "INIT", "ABORT": "ABOR", "FIXED": "FIX",
+    "SYSTEM": "SYST", "ERROR": "ERR"
+}
+
+# Options that can be given in a resource name, with the function that parses each one
+_OPTION_PARSERS = {
+    "latency": float,
+    "jitter": float,
+    "loadResistance": float,
+    "timeConstant": float,
+    "maxListLength": int,
+    "seed": int,
+    "supportsCompoundQuery": lambda value: value.lower() in ("1", "true", "yes")
+}
+
+
+def isSimulated(resourceName: str) -> bool:
+    return resourceName.upper().startswith(SIMULATED_PREFIX)
+
+
+def _shortForm(node: str) -> str:
+    node = node.strip().upper()
+    suffix = "?" if node.endswith("?") else ""
+    node = node.rstrip("?")
+    for long, short in _MNEMONICS.items():
+        if node.startswith(short) and long.startswith(node):
+            return short + suffix
+    return node + suffix
+
+
+def _timeout():
+    import pyvisa
+    return pyvisa.errors.VisaIOError(pyvisa.constants.StatusCode.error_timeout)
+
+
+class SimulatedInstrument:
+    # Stands in for a pyvisa resource: a supply driving a resistive load, with first-order output dynamics
+    def __init__(self, latency: float = 0.002, jitter: float = 0.0005, loadResistance: float = 10.0,
+            timeConstant: float = 0.005, maxListLength: int = 512, supportsCompoundQuery: bool = True,
+            idn: str = DEFAULT_IDN, clock: Clock = REAL_CLOCK, seed: int = None):
+        # Give a VirtualClock for dry runs, and a seed to make the latency jitter repeat from run to run
+        self.session = 1
+        self.commandCount = 0
+        self.timeout = 2000  # Milliseconds, as in pyvisa; only waited out while the instrument is unreachable
+        self.reachable = True  # False simulates a network outage: the instrument keeps running but nothing gets through
+        self._latency = latency
+        self._jitter = jitter
+        self._loadResistance = loadResistance
+        self._timeConstant = timeConstant
+        self._maxListLength = maxListLength
+        self._supportsCompoundQuery = supportsCompoundQuery
+        self._idn = idn
+        self._clock = clock
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._errors = []
+        self._inputOn = False
+        self._currentLimit = math.inf  # Set with an explicit SOUR: prefix, as the driver does; the current setting without one
+        self._currentSetting = 0.0
+        self._voltageSetting = 0.0
+        self._settingTime = self._clock.monotonic()
+        self._settleFrom = 0.0  # Output voltage when the output last started moving
+        self._settleTarget = 0.0  # Voltage the output is moving towards
+        self._settleStart = self._settingTime
+        self._listVoltages = []
+        self._listDwells = []
+        self._listMode = False
+        self._listArmed = False
+        self._listStart = None
+
+    def _unreachable(self):
+        self._clock.sleep(self.timeout / 1000)
+        return _timeout()
+
+    def _delay(self):
+        self._clock.sleep(max(self._latency + self._random.uniform(-self._jitter, self._jitter), 0))
+
+    def _listStep(self, now: float) -> (int, float):
+        # Index of the running list step and the time it started
+        stepStart = self._listStart
+        for step, dwell in enumerate(self._listDwells):
+            if now < stepStart + dwell:
+                return step, stepStart
+            stepStart += dwell
+        return len(self._listDwells), stepStart
+
+    def _programmedVoltage(self, now: float) -> (float, float):
+        # The voltage the output should move towards and the time it was programmed
+        if not self._inputOn:
+            return 0.0, self._settingTime
+        if self._listMode and self._listStart is not None and len(self._listVoltages) > 0:
+            step, stepStart = self._listStep(now)
+            return self._listVoltages[min(step, len(self._listVoltages) - 1)], stepStart
+        return self._voltageSetting, self._settingTime
+
+    def _settledVoltage(self, now: float) -> float:
+        decay = math.exp(-(now - self._settleStart) / self._timeConstant) if self._timeConstant > 0 else 0.0
+        return self._settleTarget + (self._settleFrom - self._settleTarget) * decay
+
+    def _outputVoltage(self, now: float) -> float:
+        target, since = self._programmedVoltage(now)
+        if target!=self._settleTarget:
+            since = max(since, self._settleStart)
+            self._settleFrom = self._settledVoltage(since)
+            self._settleTarget = target
+            self._settleStart = since
+        return self._settledVoltage(now)
+
+    def _output(self) -> (float, float):
+        voltage = max(self._outputVoltage(self._clock.monotonic()), 0.0)
+        current = voltage / self._loadResistance
+        limit = min(self._currentLimit, self._currentSetting)
+        if current > limit:  # Constant current mode
+            current = limit
+            voltage = current * self._loadResistance
+        return voltage, current
+
+    def _program(self, voltage: float = None, inputOn: bool = None):
+        now = self._clock.monotonic()
+        self._outputVoltage(now)  # Settle the old program up to now before changing it
+        if voltage is not None:
+            self._voltageSetting = voltage
+        if inputOn is not None:
+            self._inputOn = inputOn
+        self._settingTime = now
+
+    def _execute(self, command: str):
+        # Whitespace after a colon, as in "SOUR: CURR 30", is tolerated like the instrument does
+        header, _, argument = re.sub(r":\s+", ":", command.strip()).lstrip(":").partition(" ")
+        nodes = [_shortForm(node) for node in header.split(":")]
+        source = nodes[0]=="SOUR"
+        if source:
+            nodes = nodes[1:]
+        path = ":".join(nodes)
+        argument = argument.strip()
+        if path=="*IDN?":
+            return self._idn
+        elif path=="*CLS":
+            self._errors.clear()
+        elif path=="*TRG":
+            if self._listArmed:
+                self._outputVoltage(self._clock.monotonic())
+                self._listArmed = False
+                self._listStart = self._clock.monotonic()
+        elif path=="SYST:ERR?":
+            return self._errors.pop(0) if len(self._errors) > 0 else '0,"No error"'
+        elif path=="VOLT":
+            self._program(voltage=float(argument))
+        elif path=="VOLT?":
+            return str(self._voltageSetting)
+        elif path=="CURR" and source:
+            self._currentLimit = float(argument)
+        elif path=="CURR?" and source:
+            return str(self._currentLimit)
+        elif path=="CURR":
+            self._currentSetting = float(argument)
+        elif path=="CURR?":
+            return str(self._currentSetting)
+        elif path=="MEAS:VOLT?":
+            return str(self._output()[0])
+        elif path=="MEAS:CURR?":
+            return str(self._output()[1])
+        elif path=="MEAS:POW?":
+            voltage, current = self._output()
+            return str(voltage * current)
+        elif path in ("INP:START", "INP:STOP"):
+            self._program(inputOn=path=="INP:START")
+        elif path=="INP":
+            self._program(inputOn=argument.upper() in ("ON", "1"))
+        elif path=="INP?":
+            return "1" if self._inputOn else "0"
+        elif path in ("LIST:VOLT", "LIST:DWEL"):
+            values = [float(value) for value in argument.split(",")]
+            if len(values) > self._maxListLength:
+                self._errors.append('-223,"Too much data"')
+            elif path=="LIST:VOLT":
+                self._listVoltages = values
+            else:
+                self._listDwells = values
+        elif path in ("LIST:COUN", "TRIG:SOUR"):
+            pass
+        elif path=="VOLT:MODE":
+            self._outputVoltage(self._clock.monotonic())
+            self._listMode = _shortForm(argument)=="LIST"
+            if not self._listMode:
+                self._listStart = None
+                self._settingTime = self._clock.monotonic()
+        elif path=="INIT":
+            self._listArmed = self._listMode
+        elif path=="ABOR":
+            self._outputVoltage(self._clock.monotonic())
+            self._listArmed = False
+            self._listStart = None
+            self._settingTime = self._clock.monotonic()
+        elif path=="LIST:STEP?":
+            return str(self._listStep(self._clock.monotonic())[0] if self._listStart is not None else 0)
+        else:
+            self._errors.append('-113,"Undefined header"')
+            if header.endswith("?"):
+                raise _timeout()  # Real instruments never answer a query they did not understand
+        return None
+
+    def write(self, command: str):
+        if self.session is None:
+            import pyvisa
+            raise pyvisa.errors.InvalidSession()
+        if not self.reachable:
+            raise self._unreachable()
+        self._delay()
+        with self._lock:
+            self.commandCount += 1
+            for part in command.split(";"):
+                if part.strip()!="":
+                    self._execute(part)
+
+    def query(self, query: str) -> str:
+        if self.session is None:
+            import pyvisa
+            raise pyvisa.errors.InvalidSession()
+        if not self.reachable:
+            raise self._unreachable()
+        self._delay()
+        self._delay()  # A query costs a round trip
+        parts = [part for part in query.split(";") if part.strip()!=""]
+        with self._lock:
+            self.commandCount += 1
+            if len(parts) > 1 and not self._supportsCompoundQuery:
+                self._errors.append('-113,"Undefined header"')
+                raise _timeout()
+            answers = [self._execute(part) for part in parts]
+        return ";".join(answer for answer in answers if answer is not None) + "\n"
+
+    def close(self):
+        self.session = None
+
+
+class SimulatedResourceManager:
+    # Drop-in for pyvisa.ResourceManager that opens SimulatedInstruments
+    def __init__(self, **options):
+        self._options = options
+        self._reachable = True
+        self.lastOpened = None
+
+    def setReachable(self, reachable: bool):
+        # Cuts or restores the simulated link to the instrument opened last and to any opened later
+        self._reachable = reachable
+        if self.lastOpened is not None:
+            self.lastOpened.reachable = reachable
+
+    def open_resource(self, resourceName: str, open_timeout: int = 0) -> SimulatedInstrument:
+        if not self._reachable:
+            self._options.get("clock", REAL_CLOCK).sleep(open_timeout / 1000)
+            raise _timeout()
+        options = dict(self._options)
+        for option in resourceName[len(SIMULATED_PREFIX):].split("::"):
+            key, separator, value = option.partition("=")
+            if separator!="" and key in _OPTION_PARSERS:
+                options[key] = _OPTION_PARSERS[key](value)
+        self.lastOpened = SimulatedInstrument(**options)
+        return self.lastOpened
+
+    def list_resources(self) -> tuple:
+        return (SIMULATED_PREFIX + "INSTR",)
@@ -16,6 +16,24 @@ SET settings=%dirPath%%settingsDir%"
 @robocopy ./ %output% main.py 
 @robocopy ./ %output% powersupplyexp.py
 @robocopy ./ %output% tkutils.py
+@robocopy ./ %output% asyncpowersupply.py
+@robocopy ./ %output% scheduler.py
+@robocopy ./ %output% datawriter.py
+@robocopy ./ %output% instrumentio.py
+@robocopy ./ %output% instrumentmanager.py
+@robocopy ./ %output% listmode.py
+@robocopy ./ %output% samplebuffer.py
+@robocopy ./ %output% stripchart.py
+@robocopy ./ %output% simulatedsupply.py
+@robocopy ./ %output% setpointsource.py
+@robocopy ./ %output% waveform.py
+@robocopy ./ %output% batch.py
+@robocopy ./ %output% metrics.py
+@robocopy ./ %output% analysis.py
+@robocopy ./ %output% acquisition.py
+@robocopy ./ %output% clock.py
+@robocopy ./ %output% dryrun.py
+@robocopy ./ %output% visaresources.py
 @robocopy ./settings %settings%
 
 @pause
\ No newline at end of file
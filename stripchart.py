@@ -0,0 +1,139 @@
+from tkutils import *
+
+INITIAL_SPAN = 0.01  # Seconds covered by one pixel column before the chart starts compressing
+CHART_PADDING = 10
+LEGEND_SPACING = 150
+
+# Column in the sample buffer, legend text, color and the group whose members share a vertical scale
+CHART_SERIES = [
+    (1, "Target voltage", BLUE, "voltage"),
+    (2, "Actual voltage", "#ffcc66", "voltage"),
+    (3, "Current", "#ff6666", "current"),
+    (4, "Power", FINISHED_GREEN, "power")
+]
+
+
+class MinMaxDecimator:
+    # Keeps the minimum and maximum of every series per pixel column, so spikes survive any amount of compression
+    def __init__(self, columns: int, seriesCount: int, span: float = INITIAL_SPAN):
+        self._columns = columns
+        self._span = span
+        self._mins = [[] for _ in range(seriesCount)]
+        self._maxs = [[] for _ in range(seriesCount)]
+
+    def getSpan(self):
+        return self._span
+
+    def getColumns(self):
+        return self._columns
+
+    def _compress(self):
+        # Halves the resolution so that twice as much time fits in the same number of columns
+        self._span *= 2
+        for series in range(len(self._mins)):
+            self._mins[series] = _pairwise(self._mins[series], min)
+            self._maxs[series] = _pairwise(self._maxs[series], max)
+
+    def append(self, elapsedTime: float, values):
+        column = int(max(elapsedTime, 0) / self._span)
+        while column >= self._columns:
+            self._compress()
+            column = int(max(elapsedTime, 0) / self._span)
+        for series, value in enumerate(values):
+            mins, maxs = self._mins[series], self._maxs[series]
+            while len(mins) <= column:
+                mins.append(None)
+                maxs.append(None)
+            if mins[column] is None or value < mins[column]:
+                mins[column] = value
+            if maxs[column] is None or value > maxs[column]:
+                maxs[column] = value
+
+    def getSeries(self, series: int) -> (list, list):
+        return self._mins[series], self._maxs[series]
+
+
+def _pairwise(values: list, combine) -> list:
+    combined = []
+    for i in range(0, len(values), 2):
+        pair = [value for value in values[i:i + 2] if value is not None]
+        combined.append(combine(pair) if len(pair) > 0 else None)
+    return combined
+
+
+class StripChart:
+    def __init__(self, master: tk.Misc, width: int, height: int, frameRate: float = DEFAULT_FRAME_RATE):
+        self._canvas = tk.Canvas(master, width=width, height=height, background=GRAY, highlightthickness=0)
+        self._width = width
+        self._height = height
+        self._frameRate = frameRate
+        self._source = None
+        self._followed = None
+        self._consumed = 0
+        self._decimator = MinMaxDecimator(width - 2 * CHART_PADDING, len(CHART_SERIES))
+        self._lines = []
+        for i, (column, name, color, group) in enumerate(CHART_SERIES):
+            self._lines.append(self._canvas.create_line(0, 0, 0, 0, fill=color))
+            self._canvas.create_text(CHART_PADDING + i * LEGEND_SPACING, CHART_PADDING, text=name, fill=color,
+                anchor=tk.NW, font=DEFAULT_FONT)
+        self._tick()
+
+    def getCanvas(self):
+        return self._canvas
+
+    def setSource(self, sampleBuffer):
+        # Called from the experiment thread; the chart switches to the new buffer on its next tick
+        self._source = sampleBuffer
+
+    def _readNewSamples(self):
+        source = self._source
+        if source is None:
+            return False
+        count = source.getCount()
+        if self._followed is not source or count < self._consumed:  # A shared buffer restarts at 0 for every run
+            self._followed = source
+            self._consumed = 0
+            self._decimator = MinMaxDecimator(self._decimator.getColumns(), len(CHART_SERIES))
+        if count==self._consumed:
+            return False
+        columns = source.latest(count - self._consumed)
+        for row in zip(columns[0], *(columns[column] for column, name, color, group in CHART_SERIES)):
+            self._decimator.append(row[0], row[1:])
+        self._consumed = count
+        return True
+
+    def _groupRanges(self) -> dict:
+        ranges = {}
+        for series, (column, name, color, group) in enumerate(CHART_SERIES):
+            mins, maxs = self._decimator.getSeries(series)
+            values = [value for value in mins + maxs if value is not None]
+            if len(values)==0:
+                continue
+            low, high = min(values), max(values)
+            if group in ranges:
+                low, high = min(low, ranges[group][0]), max(high, ranges[group][1])
+            ranges[group] = (low, high)
+        return ranges
+
+    def _redraw(self):
+        ranges = self._groupRanges()
+        plotHeight = self._height - 3 * CHART_PADDING - DEFAULT_FONT[1]
+        for series, (column, name, color, group) in enumerate(CHART_SERIES):
+            if group not in ranges:
+                continue
+            bottom, top = ranges[group]
+            scale = plotHeight / (top - bottom) if top > bottom else 0
+            mins, maxs = self._decimator.getSeries(series)
+            coords = []
+            for x, (columnMin, columnMax) in enumerate(zip(mins, maxs)):
+                if columnMin is None:
+                    continue
+                coords += [CHART_PADDING + x, self._height - CHART_PADDING - (columnMin - bottom) * scale,
+                    CHART_PADDING + x, self._height - CHART_PADDING - (columnMax - bottom) * scale]
+            if len(coords) >= 4:
+                self._canvas.coords(self._lines[series], coords)
+
+    def _tick(self):
+        if self._readNewSamples():
+            self._redraw()  # Costs one pass over the pixel columns no matter how many samples the run has
+        self._canvas.after(max(int(1000 / self._frameRate), 1), self._tick)
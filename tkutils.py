@@ -1,4 +1,5 @@
 import sys
+import threading
 import tkinter as tk
 from tkinter import ttk
 
@@ -34,6 +35,9 @@ DEFAULT_CHECKBUTTON = {
 }
 
 FINISHED_GREEN = "#00ff00"
+PAUSED_YELLOW = "#ffd700"
+
+DEFAULT_FRAME_RATE = 20  # Readout refreshes per second
 
 
 def getDefaultDict(classType) -> dict:
@@ -83,18 +87,56 @@ def entryCheckButtonCombo(master, labelText: str) -> (tk.Frame, tk.BooleanVar):
     return frame, boolVar
 
 
+class ReadoutBus:
+    # Worker threads post values here, and one after() tick on the main thread applies only the newest of each
+    def __init__(self, frameRate: float = DEFAULT_FRAME_RATE):
+        self._frameRate = frameRate
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._master = None
+
+    def post(self, key, apply):
+        with self._lock:
+            self._pending[key] = apply
+
+    def setFrameRate(self, frameRate: float):
+        self._frameRate = frameRate
+
+    def start(self, master: tk.Misc):
+        if self._master is None:
+            self._master = master.winfo_toplevel()
+            self._tick()
+
+    def _tick(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for apply in pending.values():
+            apply()
+        self._master.after(max(int(1000 / self._frameRate), 1), self._tick)
+
+
+_readoutBus = ReadoutBus()
+
+
+def getReadoutBus() -> ReadoutBus:
+    return _readoutBus
+
+
 class Readout:
-    def __init__(self, stringVar: tk.StringVar, label: tk.Label, prefix: str):
+    def __init__(self, stringVar: tk.StringVar, label: tk.Label, prefix: str, bus: ReadoutBus = None):
         self.__stringVar = stringVar
         self.__label = label
         self.__label.config(textvariable=stringVar, **DEFAULT_LABEL)
         self.__prefix = prefix
+        self.__bus = _readoutBus if bus is None else bus
+        self.__bus.start(label)
 
     def getLabel(self):
         return self.__label
 
     def update(self, value):
-        self.__label.after(0, self.__stringVar.set(self.__prefix + str(value)))  # Booting this function call back to the main thread to avoid tkinter crashes
+        text = self.__prefix + str(value)
+        self.__bus.post((self, "text"), lambda: self.__stringVar.set(text))  # Applied on the main thread to avoid tkinter crashes
 
     def recolor(self, color: str):
-        self.__label.config(fg=color)
+        self.__bus.post((self, "color"), lambda: self.__label.config(fg=color))
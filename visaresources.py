@@ -0,0 +1,50 @@
+import threading
+
+SCAN_QUERY = "?*::INSTR"  # Instruments only, leaving out interfaces such as bare serial ports
+SCAN_TIMEOUT = 500  # Milliseconds each found instrument gets to open and answer *IDN?
+
+_resourceManager = None
+_resourceManagerLock = threading.Lock()
+
+
+def getResourceManager():
+    # pyvisa and its backend are loaded on first use, off the window's thread, and every supply shares one manager
+    global _resourceManager
+    with _resourceManagerLock:
+        if _resourceManager is None:
+            import pyvisa
+            _resourceManager = pyvisa.ResourceManager()
+        return _resourceManager
+
+
+def _identify(resourceManager, resourceName: str, timeout: int) -> str:
+    import pyvisa
+    try:
+        instrument = resourceManager.open_resource(resourceName, open_timeout=timeout)
+        try:
+            instrument.timeout = timeout
+            return instrument.query("*IDN?").strip()
+        finally:
+            instrument.close()
+    except (pyvisa.errors.Error, ValueError, AttributeError):  # Not answering, or not a message based instrument
+        return None
+
+
+def scanResources(onScanned, query: str = SCAN_QUERY, identify: bool = True, timeout: int = SCAN_TIMEOUT):
+    # Lists instruments on a background thread; onScanned([(resourceName, idn or None), ...]) is called from that thread
+    def scan():
+        try:
+            import pyvisa
+        except ImportError:
+            onScanned([])
+            return
+        try:
+            resourceManager = getResourceManager()
+            resourceNames = resourceManager.list_resources(query)
+        except (pyvisa.errors.Error, ValueError, OSError):  # No VISA backend, or nothing found
+            onScanned([])
+            return
+        onScanned([(resourceName, _identify(resourceManager, resourceName, timeout) if identify else None)
+            for resourceName in resourceNames])
+
+    threading.Thread(target=scan, daemon=True).start()
@@ -0,0 +1,186 @@
+import json
+import math
+
+from scheduler import DEFAULT_STEP_PERIOD
+from setpointsource import SetpointFileError, SetpointSource
+
+
+class Segment:
+    # One piece of a waveform; times are seconds from the start of the segment
+    def __init__(self, duration: float):
+        if duration < 0:
+            raise ValueError("A waveform segment cannot have a negative duration")
+        self._duration = duration
+
+    def getDuration(self) -> float:
+        return self._duration
+
+    def valueAt(self, time: float) -> float:
+        raise NotImplementedError
+
+
+class Ramp(Segment):
+    def __init__(self, start: float, end: float, duration: float):
+        super().__init__(duration)
+        self._start = start
+        self._end = end
+
+    def valueAt(self, time):
+        if self._duration==0:
+            return self._end
+        return self._start + (self._end - self._start) * min(time / self._duration, 1.0)
+
+
+class Step(Segment):
+    # Holds each level for dwell seconds; a single level is a plain hold, several make a staircase
+    def __init__(self, levels: list, dwell: float):
+        super().__init__(dwell * len(levels))
+        self._levels = levels
+        self._dwell = dwell
+
+    def valueAt(self, time):
+        if self._dwell==0:
+            return self._levels[-1]
+        return self._levels[min(int(time / self._dwell), len(self._levels) - 1)]
+
+
+class Sine(Segment):
+    def __init__(self, offset: float, amplitude: float, frequency: float, duration: float, phase: float = 0.0):
+        super().__init__(duration)
+        self._offset = offset
+        self._amplitude = amplitude
+        self._frequency = frequency
+        self._phase = phase  # Degrees
+
+    def valueAt(self, time):
+        return self._offset + self._amplitude * math.sin(2 * math.pi * self._frequency * time + math.radians(self._phase))
+
+
+class Triangle(Segment):
+    # Rises from low to high over the first half of each period and falls back over the second
+    def __init__(self, low: float, high: float, period: float, duration: float):
+        super().__init__(duration)
+        if period <= 0:
+            raise ValueError("A triangle wave needs a positive period")
+        self._low = low
+        self._high = high
+        self._period = period
+
+    def valueAt(self, time):
+        fraction = (time / self._period) % 1.0
+        return self._low + (self._high - self._low) * (1.0 - abs(2.0 * fraction - 1.0))
+
+
+class PWM(Segment):
+    # High for dutyCycle (0 to 1) of each period, low for the rest
+    def __init__(self, low: float, high: float, period: float, dutyCycle: float, duration: float):
+        super().__init__(duration)
+        if period <= 0:
+            raise ValueError("A PWM wave needs a positive period")
+        self._low = low
+        self._high = high
+        self._period = period
+        self._dutyCycle = dutyCycle
+
+    def valueAt(self, time):
+        return self._high if (time / self._period) % 1.0 < self._dutyCycle else self._low
+
+
+class PiecewiseLinear(Segment):
+    # points are (time, voltage) pairs in time order; the voltage before the first point is held from time 0
+    def __init__(self, points: list):
+        if len(points)==0:
+            raise ValueError("A piecewise-linear segment needs at least one point")
+        if any(later[0] < earlier[0] for earlier, later in zip(points, points[1:])):
+            raise ValueError("The points of a piecewise-linear segment must be in time order")
+        super().__init__(points[-1][0])
+        self._points = points
+        self._index = 0  # Samples are taken in time order, so the search resumes where it last stopped
+
+    def valueAt(self, time):
+        if time <= self._points[0][0]:
+            return self._points[0][1]
+        if time < self._points[self._index][0]:
+            self._index = 0
+        while self._index < len(self._points) - 1 and time >= self._points[self._index + 1][0]:
+            self._index += 1
+        if self._index==len(self._points) - 1:
+            return self._points[-1][1]
+        (startTime, startVoltage), (endTime, endVoltage) = self._points[self._index], self._points[self._index + 1]
+        return startVoltage + (endVoltage - startVoltage) * (time - startTime) / (endTime - startTime)
+
+
+class WaveformSource(SetpointSource):
+    # Samples the segments one after another every samplePeriod seconds, computing each setpoint only when it is needed
+    def __init__(self, segments: list, samplePeriod: float = DEFAULT_STEP_PERIOD):
+        if samplePeriod <= 0:
+            raise ValueError("The sample period must be positive")
+        self._segments = segments
+        self._samplePeriod = samplePeriod
+        self._duration = sum(segment.getDuration() for segment in segments)
+
+    def __len__(self):
+        return math.ceil(self._duration / self._samplePeriod - 1e-9) if self._duration > 0 else 0
+
+    def __iter__(self):
+        segments = iter(self._segments)
+        segment = next(segments, None)
+        segmentStart = 0.0
+        for sample in range(len(self)):
+            time = sample * self._samplePeriod
+            while segment is not None and time >= segmentStart + segment.getDuration():
+                segmentStart += segment.getDuration()
+                segment = next(segments, None)
+            if segment is None:
+                break
+            yield segment.valueAt(time - segmentStart), min(self._samplePeriod, self._duration - time)
+
+    def hasDurations(self):
+        return True
+
+    def getTotalDuration(self):
+        return self._duration
+
+    def getSamplePeriod(self):
+        return self._samplePeriod
+
+
+# Segment types in a waveform description, with the constructor each one's parameters are passed to
+SEGMENT_TYPES = {
+    "ramp": Ramp,
+    "step": Step,
+    "sine": Sine,
+    "triangle": Triangle,
+    "pwm": PWM,
+    "piecewise": PiecewiseLinear
+}
+
+
+def fromDescription(description: dict) -> WaveformSource:
+    # e.g. {"samplePeriod": 0.01, "segments": [{"type": "ramp", "start": 0, "end": 5, "duration": 10}]}
+    segments = []
+    for number, parameters in enumerate(description.get("segments", []), 1):
+        parameters = dict(parameters)
+        segmentType = parameters.pop("type", None)
+        if segmentType not in SEGMENT_TYPES:
+            raise SetpointFileError(f"Segment {number} has the unknown type \"{segmentType}\"; "
+                f"expected one of {', '.join(SEGMENT_TYPES)}")
+        try:
+            segments.append(SEGMENT_TYPES[segmentType](**parameters))
+        except (TypeError, ValueError) as error:
+            raise SetpointFileError(f"Segment {number} ({segmentType}): {error}")
+    try:
+        source = WaveformSource(segments, description.get("samplePeriod", DEFAULT_STEP_PERIOD))
+    except ValueError as error:
+        raise SetpointFileError(str(error))
+    source.origin = description
+    return source
+
+
+def openWaveformFile(path: str) -> WaveformSource:
+    with open(path, "r") as file:
+        try:
+            description = json.load(file)
+        except json.JSONDecodeError as error:
+            raise SetpointFileError(f"{path} is not a valid waveform description: {error}")
+    return fromDescription(description)